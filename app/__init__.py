@@ -1,13 +1,16 @@
+import os
+import click
 from flask import Flask, request, current_app
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
-from elasticsearch import Elasticsearch
+from jinja2 import FileSystemBytecodeCache
 from config import Config
 from flask_babel import Babel
+from app.cache import SearchCache, create_cache
+from app.replicas import RoutingSession
+from app.search import LazyClient, create_backend, create_client
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login = LoginManager()
 login.login_view = 'auth.login'
 babel = Babel()
@@ -15,14 +18,47 @@ babel = Babel()
 def get_locale():
     return request.accept_languages.best_match(current_app.config['LANGUAGES'])
 
+class MigrateGroup(click.Group):
+    # Stands in for Flask-Migrate's "flask db" group, so alembic is only
+    # imported when a migration command runs rather than by every worker.
+    def _group(self, ctx):
+        from flask.cli import ScriptInfo
+        from flask_migrate import Migrate
+        app = ctx.ensure_object(ScriptInfo).load_app()
+        if 'migrate' not in app.extensions:
+            Migrate(app, db)
+        return app.cli.commands['db']
+
+    def list_commands(self, ctx):
+        return self._group(ctx).list_commands(ctx)
+
+    def get_command(self, ctx, name):
+        return self._group(ctx).get_command(ctx, name)
+
 def create_app(config_class=Config):
     app = Flask(__name__)
     app.config.from_object(config_class)
+    if app.config['TEMPLATE_CACHE_PATH']:
+        # Compiled templates are shared on disk, so only the first worker
+        # to render a template pays for compiling it.
+        os.makedirs(app.config['TEMPLATE_CACHE_PATH'], exist_ok=True)
+        app.jinja_options = dict(app.jinja_options, bytecode_cache=
+                                 FileSystemBytecodeCache(
+                                     app.config['TEMPLATE_CACHE_PATH']))
     db.init_app(app)
-    migrate.init_app(app, db)
     login.init_app(app)
     babel.init_app(app, locale_selector=get_locale)
 
+    from app import sqlite
+    sqlite.init_app(app)
+    app.writer = sqlite.WriteQueue(app)
+
+    from app import instrumentation
+    instrumentation.init_app(app)
+
+    from app import replicas
+    replicas.init_app(app)
+
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
 
@@ -32,8 +68,42 @@ def create_app(config_class=Config):
     from app.main import bp as main_bp
     app.register_blueprint(main_bp)
 
-    app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+
+    from app.cli import bp as cli_bp
+    app.register_blueprint(cli_bp)
+    app.cli.add_command(MigrateGroup('db', help='Perform database migrations.'))
+
+    app.elasticsearch = LazyClient(create_client, app) \
         if app.config['ELASTICSEARCH_URL'] else None
+    app.search_backend = create_backend(app)
+    app.search_cache = SearchCache(app.config['SEARCH_CACHE_SIZE'],
+                                   app.config['SEARCH_CACHE_TTL'])
+
+    from app.indexer import SearchIndexer
+    app.search_indexer = SearchIndexer(app)
+
+    from app.pantry import PantryIndex
+    app.pantry_index = PantryIndex(app)
+
+    from app.similar import SimilarIndex
+    app.similar_index = SimilarIndex(app)
+
+    from app.autocomplete import Autocomplete
+    app.autocomplete = Autocomplete(app)
+
+    app.fragment_cache = create_cache(app)
+
+    from app.last_seen import LastSeenBuffer
+    app.last_seen = LastSeenBuffer(app)
+
+    from app.images import ImageStore
+    app.images = ImageStore(app)
+
+    if app.config['WARM_UP']:
+        from app.warmup import warm_up
+        warm_up(app)
     return app
 
 from app import models # noqa
@@ -0,0 +1,36 @@
+import gzip
+from flask import current_app, request
+import orjson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def json_response(payload, status=200):
+    return current_app.response_class(
+        orjson.dumps(payload, option=orjson.OPT_NAIVE_UTC), status=status,
+        mimetype='application/json')
+
+
+def compress(response):
+    if response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    # Below a packet or so compressing costs more time than it saves.
+    if len(data) < current_app.config['API_COMPRESS_MIN_SIZE']:
+        return response
+    encoding = request.accept_encodings.best_match(
+        ['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        response.set_data(brotli.compress(
+            data, quality=current_app.config['API_BROTLI_QUALITY']))
+    elif encoding == 'gzip':
+        response.set_data(gzip.compress(
+            data, compresslevel=current_app.config['API_GZIP_LEVEL']))
+    else:
+        return response
+    response.headers['Content-Encoding'] = encoding
+    return response
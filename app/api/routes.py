@@ -0,0 +1,145 @@
+from collections import defaultdict
+from flask import current_app, request, url_for
+from flask_login import current_user
+import sqlalchemy as sa
+from app import db
+from app.api import bp
+from app.api.errors import bad_request, error_response
+from app.api.responses import compress, json_response
+from app.instrumentation import query_budget
+from app.models import Ingredient, Recipe, User
+from app.pagination import keyset_paginate
+from app.replicas import read_replica
+
+RECIPE_COLUMNS = {
+    'title': Recipe.title,
+    'method': Recipe.method,
+    'servings': Recipe.servings,
+    'image': Recipe.image,
+    'timestamp': Recipe.timestamp,
+    'updated': Recipe.updated,
+    'creator': User.username,
+}
+RECIPE_FIELDS = set(RECIPE_COLUMNS) | {'ingredients'}
+
+bp.after_request(compress)
+
+
+@bp.before_request
+def authenticate():
+    if not current_user.is_authenticated:
+        return error_response(401)
+
+
+def requested_fields():
+    fields = request.args.get('fields')
+    if not fields:
+        return RECIPE_FIELDS
+    fields = set(fields.split(','))
+    unknown = fields - RECIPE_FIELDS
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(sorted(unknown)))
+    return fields
+
+
+def recipe_query(fields):
+    # Only the requested columns are selected, plus the timestamp that
+    # cursors are made from.
+    names = sorted(fields & RECIPE_COLUMNS.keys() | {'timestamp'})
+    query = sa.select(Recipe.id, *[RECIPE_COLUMNS[name].label(name)
+                                   for name in names])
+    if 'creator' in names:
+        query = query.join(Recipe.creator)
+    return query
+
+
+def recipe_payloads(rows, fields):
+    # The ingredients of every recipe come from one more query, so a page
+    # costs the same number of queries whatever its size.
+    ingredients = defaultdict(list)
+    if 'ingredients' in fields and rows:
+        for row in db.session.execute(
+                sa.select(Ingredient.recipe_id, Ingredient.id,
+                          Ingredient.description, Ingredient.quantity,
+                          Ingredient.unit)
+                .where(Ingredient.recipe_id.in_([row.id for row in rows]))
+                .order_by(Ingredient.id)):
+            ingredients[row.recipe_id].append({
+                'id': row.id, 'description': row.description,
+                'quantity': row.quantity, 'unit': row.unit})
+    payloads = []
+    for row in rows:
+        payload = {'id': row.id}
+        for name in sorted(fields):
+            if name == 'ingredients':
+                payload[name] = ingredients[row.id]
+            elif name == 'creator':
+                payload[name] = {'username': row.creator}
+            elif name == 'image':
+                payload[name] = url_for('main.image', image=row.image,
+                                        name='large.webp') \
+                    if row.image else None
+            else:
+                payload[name] = getattr(row, name)
+        payloads.append(payload)
+    return payloads
+
+
+@bp.route('/recipes/<int:id>')
+@read_replica
+@query_budget(3)
+def get_recipe(id):
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return bad_request(str(e))
+    row = db.session.execute(recipe_query(fields).where(Recipe.id == id)).first()
+    if row is None:
+        return error_response(404)
+    return json_response(recipe_payloads([row], fields)[0])
+
+
+@bp.route('/recipes')
+@read_replica
+@query_budget(3)
+def get_recipes():
+    try:
+        fields = requested_fields()
+    except ValueError as e:
+        return bad_request(str(e))
+    limit = current_app.config['API_BATCH_SIZE']
+    if 'ids' in request.args:
+        try:
+            ids = list(dict.fromkeys(
+                int(id) for id in request.args['ids'].split(',')))
+        except ValueError:
+            return bad_request('ids must be a comma separated list of integers')
+        if len(ids) > limit:
+            return bad_request('At most {} ids per request'.format(limit))
+        rows = {row.id: row for row in db.session.execute(
+            recipe_query(fields).where(Recipe.id.in_(ids)))}
+        return json_response({
+            'items': recipe_payloads([rows[id] for id in ids if id in rows],
+                                     fields),
+            'missing': [id for id in ids if id not in rows]})
+    per_page = request.args.get('limit', current_app.config['RECIPES_PER_PAGE'],
+                                type=int)
+    if not 0 < per_page <= limit:
+        return bad_request('limit must be between 1 and {}'.format(limit))
+    page = keyset_paginate(recipe_query(fields), Recipe.timestamp, Recipe.id,
+                           per_page, after=request.args.get('after'),
+                           before=request.args.get('before'),
+                           factory=lambda row: row)
+    args = {'fields': request.args.get('fields'), 'limit': per_page}
+    return json_response({
+        'items': recipe_payloads(page.items, fields),
+        'next_cursor': page.next_cursor,
+        'prev_cursor': page.prev_cursor,
+        '_links': {
+            'self': url_for('api.get_recipes', after=request.args.get('after'),
+                            before=request.args.get('before'), **args),
+            'next': url_for('api.get_recipes', after=page.next_cursor, **args)
+            if page.has_next else None,
+            'prev': url_for('api.get_recipes', before=page.prev_cursor, **args)
+            if page.has_prev else None,
+        }})
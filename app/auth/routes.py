@@ -1,4 +1,4 @@
-from flask import render_template, redirect, url_for, flash, request, g
+from flask import current_app, render_template, redirect, url_for, flash, request, g
 from flask_babel import _, get_locale
 from urllib.parse import urlsplit
 from flask_login import login_user, logout_user, current_user
@@ -43,8 +43,7 @@ def register():
     if form.validate_on_submit():
         user = User(username=form.username.data, email=form.email.data)
         user.set_password(form.password.data)
-        db.session.add(user)
-        db.session.commit()
+        current_app.writer.run(lambda: db.session.add(user))
         flash(_('Congratulations, you are now a registered user!'))
         return redirect(url_for('auth.login'))
     return render_template('register.html', title=_('Register'), form=form)
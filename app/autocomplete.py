@@ -0,0 +1,142 @@
+import heapq
+import threading
+from bisect import bisect_left, bisect_right
+import sqlalchemy as sa
+from app import db
+
+
+def normalize_key(text):
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    # Terms are kept in a sorted list with parallel weight and label lists.
+    # A prefix is a contiguous range of that list; the best completions for
+    # the short, wide prefixes are precomputed so no query scans far.
+    TOP_PREFIX = 2
+
+    def __init__(self, max_terms, max_length, results):
+        self.max_terms = max_terms
+        self.max_length = max_length
+        self.results = results
+        self._keys = []
+        self._weights = []
+        self._labels = []
+        self._top = {}
+
+    def load(self, counts, labels):
+        keys = heapq.nlargest(self.max_terms, counts, key=counts.get)
+        keys.sort()
+        self._keys = keys
+        self._weights = [counts[key] for key in keys]
+        self._labels = [labels[key] for key in keys]
+        self._top = {}
+        prefixes = {key[:length] for key in keys
+                    for length in range(1, self.TOP_PREFIX + 1)}
+        for prefix in prefixes:
+            self._top[prefix] = self._scan(prefix)
+
+    def _range(self, prefix):
+        start = bisect_left(self._keys, prefix)
+        return start, bisect_right(self._keys, prefix + '\uffff', start)
+
+    def _scan(self, prefix):
+        start, end = self._range(prefix)
+        best = heapq.nlargest(self.results, range(start, end),
+                              key=self._weights.__getitem__)
+        return [(self._weights[i], self._keys[i]) for i in best]
+
+    def add(self, text, delta):
+        key = normalize_key(text)[:self.max_length]
+        if not key:
+            return
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            weight = self._weights[i] + delta
+            if weight > 0:
+                self._weights[i] = weight
+            else:
+                del self._keys[i], self._weights[i], self._labels[i]
+                weight = 0
+        elif delta > 0 and len(self._keys) < self.max_terms:
+            self._keys.insert(i, key)
+            self._weights.insert(i, delta)
+            self._labels.insert(i, text.strip()[:self.max_length])
+            weight = delta
+        else:
+            return
+        for length in range(1, min(len(key), self.TOP_PREFIX) + 1):
+            prefix = key[:length]
+            top = self._top.get(prefix, [])
+            if weight >= (top[-1][0] if len(top) >= self.results else 0) or \
+                    any(k == key for _, k in top):
+                self._top[prefix] = self._scan(prefix)
+
+    def complete(self, text, limit):
+        prefix = normalize_key(text)[:self.max_length]
+        if not prefix:
+            return []
+        if len(prefix) <= self.TOP_PREFIX:
+            best = self._top.get(prefix, [])[:limit]
+        else:
+            start, end = self._range(prefix)
+            best = [(self._weights[i], self._keys[i]) for i in heapq.nlargest(
+                limit, range(start, end), key=self._weights.__getitem__)]
+        labels = []
+        for _, key in best:
+            i = bisect_left(self._keys, key)
+            if i < len(self._keys) and self._keys[i] == key:
+                labels.append(self._labels[i])
+        return labels
+
+
+class Autocomplete:
+    def __init__(self, app):
+        self.app = app
+        self.max_terms = app.config['AUTOCOMPLETE_MAX_TERMS']
+        self.results = app.config['AUTOCOMPLETE_RESULTS']
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._indexes = {}
+
+    def _build(self):
+        from app.models import Ingredient, Recipe
+        indexes = {}
+        for kind, column in (('ingredient', Ingredient.description),
+                             ('title', Recipe.title)):
+            counts, labels = {}, {}
+            with db.engine.connect() as conn:
+                for text, count in conn.execute(
+                        sa.select(column, sa.func.count()).group_by(column)):
+                    key = normalize_key(text or '')[:64]
+                    if key:
+                        counts[key] = counts.get(key, 0) + count
+                        labels.setdefault(key, text.strip()[:64])
+            index = PrefixIndex(self.max_terms, 64, self.results)
+            index.load(counts, labels)
+            indexes[kind] = index
+        return indexes
+
+    def _ensure_loaded(self):
+        if not self.loaded:
+            with self._lock:
+                if not self.loaded:
+                    self._indexes = self._build()
+                    self.loaded = True
+
+    def update(self, changes):
+        if not self.loaded:
+            return
+        with self._lock:
+            for kind, text, delta in changes:
+                if text:
+                    self._indexes[kind].add(text, delta)
+
+    def complete(self, kind, text, limit=None):
+        self._ensure_loaded()
+        index = self._indexes.get(kind)
+        if index is None:
+            return []
+        with self._lock:
+            return index.complete(text, max(1, min(limit or self.results,
+                                                   self.results)))
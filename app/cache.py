@@ -0,0 +1,137 @@
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, g
+from markupsafe import Markup
+
+
+class LRUCache:
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            expires, value = self._entries[key]
+            if expires is not None and expires < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries[key] = expires, value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCache:
+    # Stand-in for a local cache daemon: a SQLite file every worker process
+    # on the host opens, evicting the oldest writes past max_entries.
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY '
+                         'KEY, value BLOB, stored REAL)')
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_stored '
+                         'ON cache (stored)')
+            self._local.connection = conn
+        return conn
+
+    def get(self, key):
+        row = self.connection.execute('SELECT value FROM cache WHERE key = ?',
+                                      (repr(key),)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value):
+        conn = self.connection
+        conn.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?)',
+                     (repr(key), pickle.dumps(value), time.time()))
+        if hash(key) % 100 == 0:
+            conn.execute('DELETE FROM cache WHERE key IN (SELECT key FROM '
+                         'cache ORDER BY stored DESC LIMIT -1 OFFSET ?)',
+                         (self.max_entries,))
+
+    def delete(self, *keys):
+        self.connection.executemany('DELETE FROM cache WHERE key = ?',
+                                    [(repr(key),) for key in keys])
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache')
+
+
+class SearchCache(LRUCache):
+    # Entries are keyed by generation, so bumping it on a write orphans
+    # every cached result at once and the LRU ages them out.
+    def __init__(self, max_entries, ttl):
+        super().__init__(max_entries, ttl)
+        self.generation = 0
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+
+
+FRAGMENTS = ('ingredients', 'edit_ingredients', 'recipe_row')
+
+
+def create_cache(app):
+    if app.config['FRAGMENT_CACHE_PATH']:
+        return SharedCache(app.config['FRAGMENT_CACHE_PATH'],
+                           app.config['FRAGMENT_CACHE_SIZE'])
+    return LRUCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+
+def cached_fragment(kind, id, version, render):
+    key = (kind, id, g.get('locale'))
+    entry = current_app.fragment_cache.get(key)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    html = Markup(render())
+    current_app.fragment_cache.set(key, (version, html))
+    return html
+
+
+def invalidate_recipes(recipe_ids):
+    locales = [None] + current_app.config['LANGUAGES']
+    current_app.fragment_cache.delete(*[
+        (kind, id, locale) for id in recipe_ids for kind in FRAGMENTS
+        for locale in locales])
@@ -0,0 +1,874 @@
+import csv
+import itertools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import statistics
+import sys
+import tempfile
+import tracemalloc
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, current_app
+import click
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from werkzeug.security import generate_password_hash
+from app import db
+from app.fakes import FakeElasticsearch
+from app.instrumentation import count_queries
+from app.models import Ingredient, Recipe, SearchableMixin, User
+from app.pagination import encode_cursor, keyset_paginate
+from app.replicas import replica_keys
+from app.search import CircuitBreaker, ElasticsearchBackend, \
+    LocalSearchBackend, SearchUnavailable
+from app.units import normalize_unit
+
+bp = Blueprint('cli', __name__, cli_group=None)
+
+WORDS = ('chicken beef pork tofu salmon prawn rice pasta noodle potato '
+         'tomato onion garlic ginger chilli lemon lime basil thyme rosemary '
+         'butter cream cheese egg flour sugar honey vinegar soy sesame '
+         'roast grill bake fry simmer stew curry soup salad pie tart bread '
+         'spicy smoky sweet sour crispy creamy quick easy summer winter').split()
+SYLLABLES = 'ba ke lo mi nu ra se ti vo za cha pe'.split()
+VOCABULARY = WORDS + [''.join(s) for s in itertools.product(SYLLABLES, repeat=3)]
+ZIPF_WEIGHTS = list(itertools.accumulate(
+    1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+
+
+def synthetic_text(rng, words):
+    return ' '.join(rng.choices(VOCABULARY, cum_weights=ZIPF_WEIGHTS, k=words))
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+UNITS = ['', '', 'g', 'kg', 'ml', 'l', 'cup', 'tbsp', 'tsp', 'pinch']
+BENCH_PASSWORD = 'bench'
+
+
+def seed_database(users, recipes, seed=0, batch_size=5000):
+    rng = random.Random(seed)
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    first = (db.session.scalar(sa.select(sa.func.max(User.id))) or 0) + 1
+    user_ids = db.session.scalars(
+        sa.insert(User).returning(User.id, sort_by_parameter_order=True),
+        [{'username': 'user{}'.format(i), 'email': 'user{}@example.com'.format(i),
+          'password_hash': password_hash,
+          'about_me': synthetic_text(rng, rng.randint(0, 15))}
+         for i in range(first, first + users)]).all()
+    # A few prolific authors write most recipes.
+    author_weights = list(itertools.accumulate(
+        1 / rank ** 0.8 for rank in range(1, len(user_ids) + 1)))
+    now = datetime.now(timezone.utc)
+    for start in range(0, recipes, batch_size):
+        count = min(batch_size, recipes - start)
+        rows = []
+        for _ in range(count):
+            timestamp = now - timedelta(seconds=rng.randint(0, 365 * 86400))
+            rows.append({
+                'title': synthetic_text(rng, rng.randint(2, 5))[:64],
+                'method': synthetic_text(
+                    rng, int(rng.lognormvariate(4, 0.6)))[:1024],
+                'timestamp': timestamp, 'updated': timestamp,
+                'user_id': rng.choices(user_ids, cum_weights=author_weights)[0]})
+        recipe_ids = db.session.scalars(
+            sa.insert(Recipe).returning(Recipe.id, sort_by_parameter_order=True),
+            rows).all()
+        db.session.execute(sa.insert(Ingredient), [
+            {'description': synthetic_text(rng, rng.randint(1, 2))[:64],
+             'quantity': round(rng.lognormvariate(0.5, 1), 1),
+             'unit': rng.choice(UNITS), 'recipe_id': recipe_id}
+            for recipe_id in recipe_ids
+            for _ in range(max(1, min(30, round(rng.lognormvariate(2, 0.4)))))])
+        db.session.commit()
+        yield start + count
+
+
+@bp.cli.command()
+@click.option('--chunk-size', default=1000, help='Rows per bulk request.')
+@click.option('--workers', default=4, help='Concurrent bulk requests.')
+@click.option('--fresh', is_flag=True,
+              help='Build a new index and swap the alias to it when done.')
+@click.option('--resume', is_flag=True,
+              help='Continue from the last checkpoint.')
+def reindex(chunk_size, workers, fresh, resume):
+    """Rebuild the search index from the database."""
+    def progress(index, last_id):
+        click.echo('{}: indexed up to id {}'.format(index, last_id))
+
+    for model in SearchableMixin.__subclasses__():
+        model.reindex(chunk_size=chunk_size, workers=workers, fresh=fresh,
+                      resume=resume, progress=progress)
+
+
+@bp.cli.command('compile-templates')
+def compile_templates():
+    """Compile every template into the shared bytecode cache."""
+    from app.warmup import compile_templates
+    if not current_app.config['TEMPLATE_CACHE_PATH']:
+        raise click.ClickException('TEMPLATE_CACHE_PATH is not set.')
+    names = compile_templates(current_app)
+    click.echo('Compiled {} templates into {}'.format(
+        len(names), current_app.config['TEMPLATE_CACHE_PATH']))
+
+
+@bp.cli.group()
+def search():
+    """Search index maintenance."""
+    pass
+
+
+@search.command()
+def drain():
+    """Ship all pending search outbox entries."""
+    total = 0
+    while count := current_app.search_indexer.drain():
+        total += count
+    click.echo('Indexed {} outbox entries'.format(total))
+
+
+@search.command()
+def status():
+    """Show search outbox backlog and lag."""
+    pending, lag = current_app.search_indexer.lag()
+    click.echo('{} pending entries, oldest {:.1f}s old'.format(pending, lag))
+
+
+@bp.cli.group()
+def replicas():
+    """Read replica maintenance."""
+    pass
+
+
+@replicas.command('sync')
+def replicas_sync():
+    """Copy the primary SQLite database over each SQLite replica."""
+    keys = replica_keys(current_app)
+    if not keys:
+        raise click.ClickException('No replicas configured, set '
+                                   'DATABASE_REPLICA_URLS')
+    if db.engine.dialect.name != 'sqlite':
+        raise click.ClickException('Only SQLite replicas can be synced here, '
+                                   'others are kept in sync by the server')
+    source = db.engine.raw_connection()
+    try:
+        for key in keys:
+            url = db.engines[key].url
+            if url.get_backend_name() != 'sqlite':
+                raise click.ClickException('{} is not a SQLite database'.format(
+                    url.render_as_string(hide_password=True)))
+            # The backup API copies a consistent snapshot even while the
+            # primary is being written to.
+            start = time.perf_counter()
+            with sqlite3.connect(url.database) as target:
+                source.driver_connection.backup(target)
+            target.close()
+            click.echo('{}: synced {} in {:.2f}s'.format(
+                key, url.database, time.perf_counter() - start))
+    finally:
+        source.close()
+
+
+CSV_FIELDS = ['recipe', 'title', 'method', 'author', 'timestamp',
+              'description', 'quantity', 'unit']
+
+
+def read_recipes(file, format):
+    if format == 'jsonl':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+        return
+    rows = csv.DictReader(file)
+    for _, group in itertools.groupby(rows, key=lambda row: row['recipe']):
+        group = list(group)
+        yield dict(group[0], method=group[0]['method'] or None, ingredients=[
+            {'description': row['description'],
+             'quantity': float(row['quantity']) if row['quantity'] else None,
+             'unit': row['unit'] or None}
+            for row in group if row['description']])
+
+
+def import_recipes(records, author=None, batch_size=10000):
+    recipe_table = Recipe.__table__
+    insert_recipes = recipe_table.insert().returning(
+        recipe_table.c.id, sort_by_parameter_order=True)
+    insert_ingredients = Ingredient.__table__.insert()
+    user_ids = {}
+    now = datetime.now(timezone.utc)
+    while batch := list(itertools.islice(records, batch_size)):
+        names = {record.get('author') or author for record in batch}
+        missing = names - user_ids.keys()
+        if missing:
+            user_ids.update(db.session.execute(
+                sa.select(User.username, User.id)
+                .where(User.username.in_(missing))).all())
+        unknown = names - user_ids.keys()
+        if unknown:
+            raise click.ClickException('Unknown authors: {}'.format(
+                ', '.join(sorted(str(name) for name in unknown))))
+        rows = []
+        for record in batch:
+            timestamp = datetime.fromisoformat(record['timestamp']) \
+                if record.get('timestamp') else now
+            rows.append({'title': record['title'],
+                         'method': record.get('method'),
+                         'image': None, 'timestamp': timestamp,
+                         'updated': timestamp,
+                         'user_id': user_ids[record.get('author') or author]})
+        conn = db.session.connection()
+        recipe_ids = conn.execute(insert_recipes, rows).scalars().all()
+        ingredients = [
+            {'description': ingredient['description'],
+             'quantity': ingredient.get('quantity'),
+             'unit': normalize_unit(ingredient.get('unit')),
+             'timestamp': now,
+             'recipe_id': recipe_id}
+            for recipe_id, record in zip(recipe_ids, batch)
+            for ingredient in record.get('ingredients', ())]
+        if ingredients:
+            conn.execute(insert_ingredients, ingredients)
+        db.session.commit()
+        current_app.pantry_index.refresh(recipe_ids)
+        current_app.similar_index.refresh(recipe_ids)
+        current_app.autocomplete.update(
+            [('title', row['title'], 1) for row in rows] +
+            [('ingredient', row['description'], 1) for row in ingredients])
+        yield recipe_ids, len(ingredients)
+
+
+def export_recipes(chunk_size=1000):
+    last_id = 0
+    while True:
+        recipes = db.session.execute(
+            sa.select(Recipe.id, Recipe.title, Recipe.method,
+                      Recipe.timestamp, User.username)
+            .join(Recipe.creator).where(Recipe.id > last_id)
+            .order_by(Recipe.id).limit(chunk_size)).all()
+        if not recipes:
+            return
+        ingredients = defaultdict(list)
+        for row in db.session.execute(
+                sa.select(Ingredient.recipe_id, Ingredient.description,
+                          Ingredient.quantity, Ingredient.unit)
+                .where(Ingredient.recipe_id.between(recipes[0].id,
+                                                    recipes[-1].id))
+                .order_by(Ingredient.recipe_id, Ingredient.id)):
+            ingredients[row.recipe_id].append(
+                {'description': row.description, 'quantity': row.quantity,
+                 'unit': row.unit})
+        for recipe in recipes:
+            yield {'recipe': recipe.id, 'title': recipe.title,
+                   'method': recipe.method, 'author': recipe.username,
+                   'timestamp': recipe.timestamp.isoformat(),
+                   'ingredients': ingredients.pop(recipe.id, [])}
+        last_id = recipes[-1].id
+
+
+def file_format(file, format):
+    if format:
+        return format
+    return 'csv' if file.name.endswith('.csv') else 'jsonl'
+
+
+@bp.cli.group()
+def recipes():
+    """Bulk recipe import and export."""
+    pass
+
+
+@recipes.command('import')
+@click.argument('file', type=click.File('r'))
+@click.option('--format', type=click.Choice(['jsonl', 'csv']),
+              help='Defaults to csv for .csv files and jsonl otherwise.')
+@click.option('--author', help='Username for records without an author.')
+@click.option('--batch-size', default=10000, help='Recipes per transaction.')
+def recipes_import(file, format, author, batch_size):
+    """Import recipes with their ingredients from JSONL or CSV."""
+    format = file_format(file, format)
+    start = time.perf_counter()
+    first_id = None
+    recipe_count = ingredient_count = 0
+    for recipe_ids, ingredients in import_recipes(
+            read_recipes(file, format), author, batch_size):
+        if first_id is None:
+            first_id = recipe_ids[0]
+        recipe_count += len(recipe_ids)
+        ingredient_count += ingredients
+        click.echo('{} recipes, {} ingredients'.format(recipe_count,
+                                                       ingredient_count))
+    click.echo('Imported in {:.1f}s'.format(time.perf_counter() - start))
+    if first_id is not None and current_app.search_backend:
+        Recipe.reindex(after_id=first_id - 1)
+        click.echo('Indexed in {:.1f}s'.format(time.perf_counter() - start))
+    current_app.search_cache.invalidate()
+
+
+@recipes.command('export')
+@click.argument('file', type=click.File('w'), default='-')
+@click.option('--format', type=click.Choice(['jsonl', 'csv']),
+              help='Defaults to csv for .csv files and jsonl otherwise.')
+def recipes_export(file, format):
+    """Export all recipes with their ingredients as JSONL or CSV."""
+    if file_format(file, format) == 'jsonl':
+        for record in export_recipes():
+            file.write(json.dumps(record) + '\n')
+        return
+    writer = csv.DictWriter(file, CSV_FIELDS)
+    writer.writeheader()
+    for record in export_recipes():
+        ingredients = record.pop('ingredients') or [{}]
+        writer.writerows(dict(record, **ingredient)
+                         for ingredient in ingredients)
+
+
+@recipes.command('normalize-units')
+@click.option('--chunk-size', default=10000, help='Ingredients per transaction.')
+def recipes_normalize_units(chunk_size):
+    """Rewrite ingredient units in their canonical form."""
+    table = Ingredient.__table__
+    update = sa.update(table).where(table.c.id == sa.bindparam('ingredient_id')) \
+        .values(unit=sa.bindparam('canonical'))
+    last_id = 0
+    changed = 0
+    while True:
+        rows = db.session.execute(
+            sa.select(table.c.id, table.c.unit, table.c.recipe_id)
+            .where(table.c.id > last_id).order_by(table.c.id)
+            .limit(chunk_size)).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = [{'ingredient_id': row.id, 'canonical': canonical,
+                    'recipe_id': row.recipe_id} for row in rows
+                   if (canonical := normalize_unit(row.unit)) != row.unit]
+        if updates:
+            conn = db.session.connection()
+            conn.execute(update, updates)
+            # Bumping the version expires cached fragments and ETags.
+            recipe_ids = {row['recipe_id'] for row in updates}
+            conn.execute(sa.update(Recipe.__table__)
+                         .where(Recipe.__table__.c.id.in_(recipe_ids))
+                         .values(updated=datetime.now(timezone.utc)))
+        db.session.commit()
+        changed += len(updates)
+        click.echo('Checked up to ingredient {}, {} changed'.format(
+            last_id, changed))
+
+
+@bp.cli.group()
+def bench():
+    """Performance benchmarks."""
+    pass
+
+
+@bench.command('search')
+@click.option('--documents', default=100000, help='Documents to index.')
+@click.option('--queries', default=200, help='Queries to time.')
+@click.option('--per-page', default=5)
+def bench_search(documents, queries, per_page):
+    """Compare the local search engine against Elasticsearch."""
+    backends = {}
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'bench-search.db')
+    backends['local'] = LocalSearchBackend(path)
+    if current_app.elasticsearch:
+        backends['elasticsearch'] = ElasticsearchBackend(
+            current_app.elasticsearch)
+    index = 'bench-recipe'
+    for name, backend in backends.items():
+        rng = random.Random(0)
+        docs = ((i, {'title': synthetic_text(rng, 3),
+                     'method': synthetic_text(rng, 60)})
+                for i in range(1, documents + 1))
+        start = time.perf_counter()
+        backend.bulk(index, docs)
+        if name == 'elasticsearch':
+            current_app.elasticsearch.indices.refresh(index=index)
+        elapsed = time.perf_counter() - start
+        click.echo('{}: indexed {} documents in {:.1f}s'.format(
+            name, documents, elapsed))
+        timings = []
+        for _ in range(queries):
+            query = synthetic_text(rng, rng.randint(1, 3))
+            page = rng.randint(1, 20)
+            start = time.perf_counter()
+            backend.search(index, query, page, per_page)
+            timings.append((time.perf_counter() - start) * 1000)
+        click.echo('{}: p50 {:.2f}ms p95 {:.2f}ms p99 {:.2f}ms '
+                   'mean {:.2f}ms'.format(
+                       name, percentile(timings, 50), percentile(timings, 95),
+                       percentile(timings, 99), statistics.mean(timings)))
+        if name == 'elasticsearch':
+            current_app.elasticsearch.indices.delete(index=index)
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@bench.command('search-outage')
+@click.option('--queries', default=20, help='Searches per phase.')
+@click.option('--delay', default=1.0,
+              help='Latency injected by the slow phase, in seconds.')
+@click.option('--timeout', default=0.25, help='Search timeout in seconds.')
+@click.option('--reset', default=2.0,
+              help='Seconds before an open circuit lets a probe through.')
+def bench_search_outage(queries, delay, timeout, reset):
+    """Search through the circuit breaker against a misbehaving fake
+    Elasticsearch server."""
+    from elasticsearch import Elasticsearch
+    server = FakeElasticsearch()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = Elasticsearch([server.url], max_retries=0,
+                           retry_on_timeout=False)
+    breaker = CircuitBreaker('fake elasticsearch',
+                             current_app.config['SEARCH_BREAKER_THRESHOLD'],
+                             reset)
+    backend = ElasticsearchBackend(client, timeout, timeout, breaker)
+    phases = [('healthy', 0, 200), ('slow', delay, 200),
+              ('failing', 0, 503), ('recovered', 0, 200)]
+    try:
+        for name, phase_delay, status in phases:
+            time.sleep(breaker.retry_after())
+            server.delay, server.status = phase_delay, status
+            outcomes = defaultdict(int)
+            timings = []
+            for _ in range(queries):
+                start = time.perf_counter()
+                try:
+                    backend.search('bench-recipe', 'curry', 1, 5)
+                    outcome = 'ok'
+                except SearchUnavailable as e:
+                    outcome = 'failed' if e.__cause__ else 'rejected'
+                timings.append((time.perf_counter() - start) * 1000)
+                outcomes[outcome] += 1
+            click.echo('{:<10} ok {:>4} failed {:>4} rejected {:>4}  '
+                       'p50 {:8.2f}ms max {:8.2f}ms  circuit {}'.format(
+                           name, outcomes['ok'], outcomes['failed'],
+                           outcomes['rejected'], percentile(timings, 50),
+                           max(timings), breaker.state))
+    finally:
+        server.shutdown()
+
+
+@bench.command('pagination')
+@click.option('--recipes', default=200000, help='Recipes to generate.')
+@click.option('--per-page', default=20)
+@click.option('--depths', default='1,10,100,1000,5000',
+              help='Comma separated page numbers to time.')
+@click.option('--repeat', default=20)
+def bench_pagination(recipes, per_page, depths, repeat):
+    """Per-page latency of OFFSET vs keyset pagination by depth."""
+    tmpdir = tempfile.mkdtemp()
+    engine = sa.create_engine('sqlite:///' + os.path.join(tmpdir, 'bench.db'))
+    db.metadata.create_all(engine)
+    start = datetime.now(timezone.utc)
+    with so.Session(engine) as session:
+        session.execute(sa.insert(User), [{'username': 'bench',
+                                           'email': 'bench@example.com'}])
+        session.execute(sa.insert(Recipe), [
+            {'title': 'Recipe {}'.format(i), 'user_id': 1,
+             'timestamp': start - timedelta(seconds=i // 3)}
+            for i in range(recipes)])
+        session.commit()
+        click.echo('{:>8} {:>12} {:>12}'.format('page', 'offset ms', 'keyset ms'))
+        for page in [int(d) for d in depths.split(',')]:
+            query = sa.select(Recipe).order_by(Recipe.timestamp.desc(),
+                                               Recipe.id.desc())
+            if (page - 1) * per_page >= recipes:
+                break
+            timings = {'offset': [], 'keyset': []}
+            cursor = None
+            if page > 1:
+                last = session.scalars(
+                    query.offset((page - 1) * per_page - 1).limit(1)).one()
+                cursor = encode_cursor(last.timestamp, last.id)
+            for _ in range(repeat):
+                t = time.perf_counter()
+                session.scalar(sa.select(sa.func.count()).select_from(Recipe))
+                session.scalars(query.offset((page - 1) * per_page)
+                                .limit(per_page)).all()
+                timings['offset'].append(time.perf_counter() - t)
+                session.expunge_all()
+                t = time.perf_counter()
+                keyset_paginate(sa.select(Recipe), Recipe.timestamp, Recipe.id,
+                                per_page, after=cursor, session=session)
+                timings['keyset'].append(time.perf_counter() - t)
+                session.expunge_all()
+            click.echo('{:>8} {:>12.2f} {:>12.2f}'.format(
+                page, statistics.median(timings['offset']) * 1000,
+                statistics.median(timings['keyset']) * 1000))
+    engine.dispose()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@bench.command('projections')
+@click.option('--sizes', default='100,1000',
+              help='Comma separated page sizes to time.')
+@click.option('--repeat', default=50)
+def bench_projections(sizes, repeat):
+    """Time and memory of a recipe list page as ORM entities or as
+    projected rows."""
+    if db.session.scalar(sa.select(sa.func.count(Recipe.id))) == 0:
+        raise click.ClickException('No data to benchmark, run "flask bench '
+                                   'seed" first.')
+    count = sa.select(sa.func.count(Ingredient.id)).where(
+        Ingredient.recipe_id == Recipe.id).scalar_subquery()
+    order = (Recipe.timestamp.desc(), Recipe.id.desc())
+
+    def entities(size):
+        recipes = db.session.scalars(
+            sa.select(Recipe, count).options(so.joinedload(Recipe.creator))
+            .order_by(*order).limit(size)).all()
+        return [(r.id, r.title, r.creator.username) for r in recipes], recipes
+
+    def projections(size):
+        recipes = [Recipe.from_row(row) for row in db.session.execute(
+            Recipe.list_query().order_by(*order).limit(size))]
+        return [(r.id, r.title, r.creator.username) for r in recipes], recipes
+
+    click.echo('{:>6} {:<12} {:>10} {:>12} {:>12}'.format(
+        'rows', 'loader', 'ms', 'retained KB', 'peak KB'))
+    for size in [int(s) for s in sizes.split(',')]:
+        for name, loader in (('entities', entities),
+                             ('projections', projections)):
+            loader(size)
+            db.session.close()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                loader(size)
+                timings.append(time.perf_counter() - start)
+                db.session.close()
+            # The session is still open, as it would be while the page
+            # renders, so the identity map counts towards what is retained.
+            tracemalloc.start()
+            result = loader(size)
+            retained, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            del result
+            db.session.close()
+            click.echo('{:>6} {:<12} {:>10.2f} {:>12.1f} {:>12.1f}'.format(
+                size, name, statistics.median(timings) * 1000,
+                retained / 1024, peak / 1024))
+
+
+@bench.command('seed')
+@click.option('--users', default=1000, help='Users to create.')
+@click.option('--recipes', default=50000, help='Recipes to create.')
+@click.option('--seed', default=0, help='Random seed.')
+def bench_seed(users, recipes, seed):
+    """Fill the database with synthetic users, recipes and ingredients."""
+    start = time.perf_counter()
+    for done in seed_database(users, recipes, seed):
+        click.echo('{} recipes'.format(done))
+    click.echo('Created {} users and {} recipes in {:.1f}s, password '
+               '"{}"'.format(users, recipes, time.perf_counter() - start,
+                             BENCH_PASSWORD))
+    if current_app.search_backend:
+        for model in SearchableMixin.__subclasses__():
+            model.reindex()
+
+
+def write_ingredients(app, writes, seed, group_commit):
+    rng = random.Random(seed)
+    timings = []
+    errors = 0
+    with app.app_context():
+        for _ in range(writes):
+            ingredient = Ingredient(description=synthetic_text(rng, 2),
+                                    quantity=rng.randint(1, 500),
+                                    unit=rng.choice(UNITS),
+                                    recipe_id=rng.randint(1, 100))
+            start = time.perf_counter()
+            try:
+                if group_commit:
+                    app.writer.run(lambda: db.session.add(ingredient))
+                else:
+                    db.session.add(ingredient)
+                    db.session.commit()
+            except sa.exc.OperationalError:
+                db.session.rollback()
+                errors += 1
+            timings.append((time.perf_counter() - start) * 1000)
+    return timings, errors
+
+
+@bench.command('writes')
+@click.option('--writes', default=2000, help='Ingredients to add per profile.')
+@click.option('--writers', default=16, help='Concurrent writer threads.')
+def bench_writes(writes, writers):
+    """Concurrent small writes with and without the SQLite production
+    profile."""
+    from app import create_app
+    from config import Config
+    for name, production in (('default', False), ('production', True)):
+        tmpdir = tempfile.mkdtemp()
+        config = type('BenchConfig', (Config,), {
+            'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(
+                tmpdir, 'bench-writes.db'),
+            'SQLALCHEMY_BINDS': {}, 'SEARCH_INDEX_PATH': None,
+            'SEARCH_INDEXER_THREAD': False, 'SQLITE_PRODUCTION': production})
+        app = create_app(config)
+        with app.app_context():
+            db.create_all()
+            for _ in seed_database(1, 100):
+                pass
+        start = time.perf_counter()
+        with ThreadPoolExecutor(writers) as executor:
+            runs = list(executor.map(
+                lambda i: write_ingredients(app, writes // writers, i,
+                                            production), range(writers)))
+        elapsed = time.perf_counter() - start
+        timings = [ms for run, _ in runs for ms in run]
+        click.echo('{:<10} {:8.1f} writes/s  p50 {:7.2f}ms p99 {:8.2f}ms  '
+                   '{} locked errors'.format(
+                       name, len(timings) / elapsed, percentile(timings, 50),
+                       percentile(timings, 99), sum(e for _, e in runs)))
+        with app.app_context():
+            db.engine.dispose()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+@bench.command('api')
+@click.option('--sizes', default='1,20,100',
+              help='Comma separated numbers of recipes to fetch at once.')
+@click.option('--repeat', default=20)
+def bench_api(sizes, repeat):
+    """Recipes per second fetched as HTML pages or in JSON API batches."""
+    from app.api.responses import brotli
+    app = current_app._get_current_object()
+    app.config['WTF_CSRF_ENABLED'] = False
+    username = db.session.scalar(sa.select(User.username).where(
+        User.email.like('%@example.com')))
+    recipe_ids = db.session.scalars(sa.select(Recipe.id).order_by(
+        sa.func.random()).limit(1000)).all()
+    if username is None or not recipe_ids:
+        raise click.ClickException('No data to benchmark, run "flask bench '
+                                   'seed" first.')
+    client = app.test_client()
+    client.post('/auth/login', data={'username': username,
+                                     'password': BENCH_PASSWORD})
+
+    def api(encoding):
+        return lambda ids: [client.get(
+            '/api/v1/recipes?ids=' + ','.join(str(id) for id in ids),
+            headers={'Accept-Encoding': encoding})]
+
+    fetchers = {'html': lambda ids: [client.get('/recipe/{}'.format(id))
+                                     for id in ids],
+                'api': api('identity'), 'api gzip': api('gzip')}
+    if brotli:
+        fetchers['api br'] = api('br')
+    rng = random.Random(0)
+    click.echo('{:>6} {:<10} {:>12} {:>12} {:>10} {:>8}'.format(
+        'batch', 'client', 'recipes/s', 'ms/batch', 'KB/recipe', 'sql'))
+    for size in [int(s) for s in sizes.split(',')]:
+        batches = [rng.sample(recipe_ids, min(size, len(recipe_ids)))
+                   for _ in range(repeat)]
+        for name, fetch in fetchers.items():
+            fetch(batches[0])
+            received = 0
+            with count_queries() as counter:
+                start = time.perf_counter()
+                for ids in batches:
+                    received += sum(len(r.data) for r in fetch(ids))
+                elapsed = time.perf_counter() - start
+            recipes = sum(len(ids) for ids in batches)
+            click.echo('{:>6} {:<10} {:>12.1f} {:>12.2f} {:>10.2f} {:>8.1f}'
+                       .format(size, name, recipes / elapsed,
+                               elapsed / repeat * 1000,
+                               received / recipes / 1024,
+                               counter.count / repeat))
+
+
+STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+status = app.test_client().get('/auth/login').status_code
+responded = time.perf_counter()
+print(json.dumps([imported - start, created - imported, responded - created,
+                  status]))
+"""
+
+
+@bench.command('startup')
+@click.option('--runs', default=5, help='Workers to start per scenario.')
+def bench_startup(runs):
+    """Import time and time to first response of a new worker."""
+    tmpdir = tempfile.mkdtemp()
+    shared = os.path.join(tmpdir, 'shared')
+    scenarios = [
+        ('no template cache', lambda i: {'TEMPLATE_CACHE_PATH': ''}),
+        ('cold template cache', lambda i: {
+            'TEMPLATE_CACHE_PATH': os.path.join(tmpdir, 'cold{}'.format(i))}),
+        ('warm template cache', lambda i: {'TEMPLATE_CACHE_PATH': shared}),
+        ('warm cache, warm-up', lambda i: {'TEMPLATE_CACHE_PATH': shared,
+                                           'WARM_UP': '1'}),
+    ]
+
+    def start_worker(env):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', STARTUP_SCRIPT], capture_output=True,
+            text=True, env=dict(os.environ, **env),
+            cwd=os.path.dirname(current_app.root_path))
+        elapsed = time.perf_counter() - start
+        if result.returncode != 0:
+            raise click.ClickException(result.stderr.strip())
+        *timings, status = json.loads(result.stdout.splitlines()[-1])
+        if status != 200:
+            raise click.ClickException('First request returned ' + str(status))
+        return timings + [elapsed]
+
+    start_worker({'TEMPLATE_CACHE_PATH': shared})
+    click.echo('{:<22} {:>10} {:>12} {:>16} {:>12}'.format(
+        'scenario', 'import ms', 'create ms', 'first resp. ms', 'process ms'))
+    for name, env in scenarios:
+        samples = [start_worker(env(i)) for i in range(runs)]
+        click.echo('{:<22} {:>10.1f} {:>12.1f} {:>16.1f} {:>12.1f}'.format(
+            name, *[statistics.median(column) * 1000
+                    for column in zip(*samples)]))
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def route_requests(usernames, recipe_ids):
+    return {
+        'main.index': lambda rng: ('GET', '/index', None),
+        'main.user': lambda rng: (
+            'GET', '/user/' + rng.choice(usernames), None),
+        'main.recipe': lambda rng: (
+            'GET', '/recipe/{}'.format(rng.choice(recipe_ids)), None),
+        'main.recipe_ingredients': lambda rng: (
+            'GET', '/recipe_ingredients/{}'.format(rng.choice(recipe_ids)),
+            None),
+        'main.search': lambda rng: (
+            'GET', '/search?q=' + synthetic_text(rng, rng.randint(1, 2)), None),
+        'api.get_recipe': lambda rng: (
+            'GET', '/api/v1/recipes/{}'.format(rng.choice(recipe_ids)), None),
+        'api.get_recipes': lambda rng: (
+            'GET', '/api/v1/recipes?ids=' + ','.join(
+                str(id) for id in rng.sample(recipe_ids, 20)), None),
+        'auth.login': lambda rng: (
+            'POST', '/auth/login', {'username': rng.choice(usernames),
+                                    'password': BENCH_PASSWORD}),
+    }
+
+
+def drive_routes(app, routes, requests, seed):
+    rng = random.Random(seed)
+    names = sorted(routes)
+    login = routes['auth.login'](rng)[2]
+    client = app.test_client()
+    client.post('/auth/login', data=login)
+    samples = {name: [] for name in names}
+    errors = 0
+    for _ in range(requests):
+        name = rng.choice(names)
+        method, url, data = routes[name](rng)
+        # Logging in only does work for an anonymous client.
+        c = app.test_client() if name == 'auth.login' else client
+        with count_queries() as counter:
+            start = time.perf_counter()
+            response = c.open(url, method=method, data=data)
+            elapsed = time.perf_counter() - start
+        if response.status_code >= 400:
+            errors += 1
+        samples[name].append((elapsed * 1000, counter.count))
+    return samples, errors
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@bench.command('routes')
+@click.option('--requests', default=2000, help='Requests to send.')
+@click.option('--concurrency', default=1, help='Concurrent clients.')
+@click.option('--seed', default=0, help='Random seed.')
+@click.option('--save', help='Save the results as a named baseline.')
+@click.option('--compare', help='Compare against a named baseline.')
+def bench_routes(requests, concurrency, seed, save, compare):
+    """Latency, throughput and SQL count of the main routes."""
+    app = current_app._get_current_object()
+    app.config['WTF_CSRF_ENABLED'] = False
+    usernames = db.session.scalars(sa.select(User.username).where(
+        User.email.like('%@example.com')).limit(1000)).all()
+    recipe_ids = db.session.scalars(sa.select(Recipe.id).order_by(
+        sa.func.random()).limit(1000)).all()
+    if not usernames or not recipe_ids:
+        raise click.ClickException('No data to benchmark, run "flask bench '
+                                   'seed" first.')
+    routes = route_requests(usernames, recipe_ids)
+    drive_routes(app, routes, 50, seed - 1)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        runs = list(executor.map(
+            lambda i: drive_routes(app, routes, requests // concurrency,
+                                   seed + i), range(concurrency)))
+    elapsed = time.perf_counter() - start
+    results = {'commit': git_commit(),
+               'created': datetime.now(timezone.utc).isoformat(),
+               'concurrency': concurrency,
+               'throughput': sum(sum(len(s) for s in samples.values())
+                                 for samples, _ in runs) / elapsed,
+               'errors': sum(errors for _, errors in runs),
+               'routes': {}}
+    for name in sorted(routes):
+        samples = [sample for run, _ in runs for sample in run[name]]
+        if not samples:
+            continue
+        timings = [ms for ms, _ in samples]
+        results['routes'][name] = {
+            'requests': len(samples),
+            'p50': percentile(timings, 50), 'p95': percentile(timings, 95),
+            'p99': percentile(timings, 99),
+            'sql': statistics.mean(queries for _, queries in samples)}
+    baseline = None
+    directory = os.path.join(app.instance_path, 'benchmarks')
+    if compare:
+        with open(os.path.join(directory, compare + '.json')) as f:
+            baseline = json.load(f)
+        click.echo('Compared with {} ({})'.format(compare, baseline['commit']))
+
+    def change(name, key):
+        if baseline is None or name not in baseline['routes']:
+            return ''
+        old = baseline['routes'][name][key]
+        new = results['routes'][name][key]
+        return ' ({:+.0f}%)'.format((new - old) / old * 100) if old else ''
+
+    click.echo('{:<26} {:>6} {:>16} {:>16} {:>16} {:>12}'.format(
+        'route', 'count', 'p50 ms', 'p95 ms', 'p99 ms', 'sql'))
+    for name, stats in results['routes'].items():
+        click.echo('{:<26} {:>6} {:>16} {:>16} {:>16} {:>12}'.format(
+            name, stats['requests'],
+            *['{:.2f}{}'.format(stats[key], change(name, key))
+              for key in ('p50', 'p95', 'p99')],
+            '{:.1f}{}'.format(stats['sql'], change(name, 'sql'))))
+    click.echo('{:.1f} requests/s with {} clients, {} errors{}'.format(
+        results['throughput'], concurrency, results['errors'],
+        ' (baseline {:.1f})'.format(baseline['throughput'])
+        if baseline else ''))
+    if save:
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, save + '.json'), 'w') as f:
+            json.dump(results, f, indent=2)
+        click.echo('Saved baseline {}'.format(save))
@@ -0,0 +1,56 @@
+import json
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeElasticsearchHandler(BaseHTTPRequestHandler):
+    def _respond(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.delay)
+        path = self.path.split('?')[0]
+        status = self.server.status
+        if status != 200:
+            body = {'error': 'injected failure', 'status': status}
+        elif path.endswith('/_search'):
+            body = {'took': 1, 'timed_out': False,
+                    'hits': {'total': {'value': 0, 'relation': 'eq'},
+                             'hits': []}}
+        elif path.endswith('/_bulk'):
+            body = {'took': 1, 'errors': False, 'items': []}
+        elif self.command == 'HEAD':
+            status, body = 404, {}
+        else:
+            body = {'name': 'fake', 'version': {'number': '8.16.0'},
+                    'tagline': 'You Know, for Search'}
+        data = json.dumps(body).encode()
+        try:
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('X-Elastic-Product', 'Elasticsearch')
+            self.end_headers()
+            if self.command != 'HEAD':
+                self.wfile.write(data)
+        except (BrokenPipeError, ConnectionResetError):
+            # the client gave up waiting
+            pass
+
+    do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeElasticsearch(ThreadingHTTPServer):
+    # Just enough of the Elasticsearch HTTP API for the client to talk to,
+    # with latency and error responses that can be changed while it runs.
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeElasticsearchHandler)
+        self.delay = 0
+        self.status = 200
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_address[1])
@@ -0,0 +1,134 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+VARIANTS = {'thumb': 256, 'large': 1024}
+FORMATS = {'.jpg': 'JPEG', '.png': 'PNG', '.gif': 'GIF', '.webp': 'WEBP'}
+
+
+class InvalidImage(Exception):
+    pass
+
+
+def verify_image(path, ext):
+    from PIL import Image
+    try:
+        with Image.open(path) as image:
+            format = image.format
+            image.verify()
+    except Exception as e:
+        raise InvalidImage(str(e)) from e
+    if format != FORMATS.get(ext):
+        raise InvalidImage('{} is not a {} image'.format(format, ext))
+
+
+def variant_names(ext):
+    fallback = 'jpg' if ext == '.jpg' else 'png'
+    return ['{}.{}'.format(variant, format) for variant in VARIANTS
+            for format in ('webp', fallback)]
+
+
+def make_variants(directory, original):
+    from PIL import Image
+    ext = os.path.splitext(original)[1].lower()
+    with Image.open(os.path.join(directory, original)) as image:
+        image.load()
+    for name in variant_names(ext):
+        variant, format = name.split('.')
+        resized = image.copy()
+        resized.thumbnail((VARIANTS[variant], VARIANTS[variant]))
+        if format == 'jpg' and resized.mode not in ('RGB', 'L'):
+            resized = resized.convert('RGB')
+        tmp = os.path.join(directory, '.' + name)
+        resized.save(tmp, format={'jpg': 'JPEG', 'png': 'PNG',
+                                  'webp': 'WEBP'}[format], quality=85)
+        os.replace(tmp, os.path.join(directory, name))
+
+
+class ImageStore:
+    def __init__(self, app):
+        self.root = os.path.abspath(app.config['UPLOAD_PATH'])
+        self.workers = app.config['IMAGE_WORKERS']
+        self.logger = app.logger
+        self._executor = None
+        self._pending = set()
+        self._failed = set()
+        self._lock = threading.Lock()
+
+    def directory(self, digest):
+        return os.path.join(self.root, digest[:2], digest)
+
+    def save(self, upload, ext):
+        os.makedirs(self.root, exist_ok=True)
+        sha = hashlib.sha256()
+        fd, tmp = tempfile.mkstemp(dir=self.root, prefix='.upload-')
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := upload.stream.read(64 * 1024):
+                sha.update(chunk)
+                f.write(chunk)
+        try:
+            verify_image(tmp, ext)
+        except InvalidImage:
+            os.remove(tmp)
+            raise
+        digest = sha.hexdigest()
+        directory = self.directory(digest)
+        os.makedirs(directory, exist_ok=True)
+        os.replace(tmp, os.path.join(directory, 'original' + ext))
+        self.process(digest, ext)
+        return digest + ext
+
+    def process(self, digest, ext):
+        with self._lock:
+            if digest in self._pending or digest in self._failed:
+                return
+            self._pending.add(digest)
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'))
+            executor = self._executor
+        try:
+            future = executor.submit(make_variants, self.directory(digest),
+                                     'original' + ext)
+        except BrokenProcessPool:
+            # A worker died since the last submit. The pool cannot be used
+            # again, so the image goes to a new one.
+            self._reset(executor)
+            with self._lock:
+                self._pending.discard(digest)
+            executor.shutdown(wait=False)
+            return self.process(digest, ext)
+        future.add_done_callback(lambda f: self._done(digest, executor, f))
+
+    def _reset(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def _done(self, digest, executor, future):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._reset(executor)
+        with self._lock:
+            self._pending.discard(digest)
+            # The image itself is only to blame when its worker survived.
+            if error is not None and not isinstance(error, BrokenProcessPool):
+                self._failed.add(digest)
+        if error is not None:
+            self.logger.error('Could not process image %s: %s', digest, error)
+
+    def locate(self, image, name):
+        digest, ext = os.path.splitext(image)
+        if ext not in FORMATS or name not in variant_names(ext):
+            return None
+        directory = self.directory(digest)
+        if os.path.exists(os.path.join(directory, name)):
+            return directory, name, True
+        if not os.path.exists(os.path.join(directory, 'original' + ext)):
+            return None
+        self.process(digest, ext)
+        return directory, 'original' + ext, False
@@ -0,0 +1,148 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import sqlalchemy as sa
+from flask import current_app
+from app import db
+from app.models import SearchableMixin, SearchOutbox
+
+
+class SearchIndexer:
+    def __init__(self, app):
+        self.app = app
+        self.batch_size = app.config['SEARCH_INDEXER_BATCH_SIZE']
+        self.interval = app.config['SEARCH_INDEXER_INTERVAL']
+        self.max_backoff = app.config['SEARCH_INDEXER_MAX_BACKOFF']
+        self.failures = 0
+        self.last_success = None
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        if app.config['SEARCH_INDEXER_THREAD'] and app.search_backend:
+            # Changes left in the outbox by an earlier process are shipped
+            # without waiting for the next write.
+            self.start()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='search-indexer', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        if self._thread is None and self.app.config['SEARCH_INDEXER_THREAD']:
+            self.start()
+        self._wakeup.set()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                try:
+                    while self.drain():
+                        pass
+                except Exception:
+                    db.session.rollback()
+                    self.failures += 1
+                    delay = min(self.max_backoff, 2 ** self.failures)
+                    self.app.logger.exception(
+                        'Search indexing failed, retrying in %ss', delay)
+                    time.sleep(delay)
+                else:
+                    self.failures = 0
+                finally:
+                    db.session.close()
+
+    def drain(self):
+        entries = db.session.scalars(
+            sa.select(SearchOutbox).order_by(SearchOutbox.id)
+            .limit(self.batch_size).with_for_update(skip_locked=True)).all()
+        if not entries:
+            return 0
+        operations = {}
+        for entry in entries:
+            operations[(entry.index_name, entry.object_id)] = entry.operation
+        changes = defaultdict(lambda: ([], []))
+        for (index, id), operation in operations.items():
+            changes[index][operation == 'delete'].append(id)
+        models = {cls.__tablename__: cls
+                  for cls in SearchableMixin.__subclasses__()}
+        for index, (updated, deleted) in changes.items():
+            model = models.get(index)
+            if model is None:
+                continue
+            documents = model.search_documents(updated) if updated else []
+            found = {id for id, _ in documents}
+            deleted.extend(id for id in updated if id not in found)
+            self.app.search_backend.bulk(index, documents, deleted)
+        db.session.execute(sa.delete(SearchOutbox).where(
+            SearchOutbox.id.in_([entry.id for entry in entries])))
+        db.session.commit()
+        self.app.search_cache.invalidate()
+        self.last_success = time.time()
+        return len(entries)
+
+    def lag(self):
+        pending, oldest = db.session.execute(sa.select(
+            sa.func.count(SearchOutbox.id),
+            sa.func.min(SearchOutbox.timestamp))).one()
+        if oldest is None:
+            return pending, 0.0
+        age = datetime.now(timezone.utc) - oldest.replace(tzinfo=timezone.utc)
+        return pending, age.total_seconds()
+
+
+def reindex(model, chunk_size=1000, workers=4, fresh=False, resume=False,
+            progress=None, after_id=0):
+    backend = current_app.search_backend
+    alias = model.__tablename__
+    os.makedirs(current_app.instance_path, exist_ok=True)
+    checkpoint = os.path.join(current_app.instance_path,
+                              'reindex-{}.json'.format(alias))
+    state = {'index': alias, 'last_id': after_id}
+    if resume and os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            state = json.load(f)
+    elif fresh:
+        state['index'] = backend.create_index(alias)
+
+    def save(last_id):
+        state['last_id'] = last_id
+        with open(checkpoint + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(checkpoint + '.tmp', checkpoint)
+        if progress:
+            progress(alias, last_id)
+
+    pending = deque()
+    last_id = state['last_id']
+    with ThreadPoolExecutor(workers) as executor:
+        while True:
+            ids = db.session.scalars(
+                sa.select(model.id).where(model.id > last_id)
+                .order_by(model.id).limit(chunk_size)).all()
+            if not ids:
+                break
+            last_id = ids[-1]
+            documents = model.search_documents(ids)
+            db.session.expunge_all()
+            pending.append((executor.submit(
+                backend.bulk, state['index'], documents), last_id))
+            while len(pending) >= workers * 2:
+                future, id = pending.popleft()
+                future.result()
+                save(id)
+        while pending:
+            future, id = pending.popleft()
+            future.result()
+            save(id)
+    if state['index'] != alias:
+        backend.swap_alias(alias, state['index'])
+    if os.path.exists(checkpoint):
+        os.remove(checkpoint)
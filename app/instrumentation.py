@@ -0,0 +1,322 @@
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+import sqlalchemy as sa
+from flask import before_render_template, current_app, g, \
+    has_app_context, has_request_context, request, template_rendered
+
+_local = threading.local()
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1,
+                2.5, 5, 10)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.statements = []
+        self.timings = []
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    for counter in getattr(_local, 'counters', ()):
+        counter.count += 1
+        counter.statements.append(statement)
+    context._query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    elapsed = time.perf_counter() - context._query_start
+    for counter in getattr(_local, 'counters', ()):
+        counter.duration += elapsed
+        counter.timings.append((statement, elapsed))
+
+
+@contextmanager
+def count_queries():
+    counter = QueryCounter()
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+def query_budget(limit):
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+def assert_max_queries(limit, counter, name):
+    if counter.count > limit:
+        raise QueryBudgetExceeded('{} ran {} SQL statements (budget {}):\n{}'.format(
+            name, counter.count, limit, '\n'.join(counter.statements)))
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    labels = dict(labels, **extra)
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value))
+                          for name, value in labels.items()) + '}'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in sorted(values):
+            yield '{}{} {}'.format(self.name, _labels(key), value)
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets=TIME_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts, total = self._values.get(
+                key, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._values[key] = counts, total + value
+
+    def samples(self):
+        with self._lock:
+            values = [(key, list(counts), total)
+                      for key, (counts, total) in self._values.items()]
+        for key, counts, total in sorted(values):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                yield '{}_bucket{} {}'.format(
+                    self.name, _labels(key, le=bound), cumulative)
+            yield '{}_sum{} {}'.format(self.name, _labels(key), total)
+            yield '{}_count{} {}'.format(self.name, _labels(key), cumulative)
+
+
+class CacheCounter:
+    type = 'counter'
+
+    def __init__(self, name, help, caches):
+        self.name = name
+        self.help = help
+        self.caches = caches
+
+    def samples(self):
+        for cache in self.caches:
+            stats = getattr(current_app, cache, None)
+            if stats is None:
+                continue
+            for result, value in (('hit', stats.hits), ('miss', stats.misses)):
+                yield '{}{} {}'.format(self.name, _labels(
+                    (), cache=cache, result=result), value)
+
+
+class Gauge:
+    type = 'gauge'
+
+    def __init__(self, name, help, value):
+        self.name = name
+        self.help = help
+        self.value = value
+
+    def samples(self):
+        yield '{} {}'.format(self.name, self.value())
+
+
+class Metrics:
+    def __init__(self):
+        self.requests = Counter(
+            'recipefinder_requests_total', 'Requests handled.')
+        self.request_duration = Histogram(
+            'recipefinder_request_duration_seconds', 'Request wall time.')
+        self.sql_statements = Histogram(
+            'recipefinder_request_sql_statements',
+            'SQL statements executed per request.', COUNT_BUCKETS)
+        self.sql_duration = Histogram(
+            'recipefinder_request_sql_duration_seconds',
+            'Time spent executing SQL per request.')
+        self.render_duration = Histogram(
+            'recipefinder_request_render_duration_seconds',
+            'Time spent rendering Jinja templates per request.')
+        self.search_duration = Histogram(
+            'recipefinder_request_search_duration_seconds',
+            'Time spent in search backend calls per request.')
+        self.search_calls = Histogram(
+            'recipefinder_search_call_duration_seconds',
+            'Latency of individual search backend calls.')
+        self.cache_lookups = CacheCounter(
+            'recipefinder_cache_lookups_total', 'Cache hits and misses.',
+            ['search_cache', 'fragment_cache'])
+        self.outbox_pending = Gauge(
+            'recipefinder_search_outbox_pending',
+            'Search index changes waiting in the outbox.',
+            lambda: current_app.search_indexer.lag()[0])
+        self.outbox_lag = Gauge(
+            'recipefinder_search_outbox_lag_seconds',
+            'Age of the oldest change waiting in the outbox.',
+            lambda: current_app.search_indexer.lag()[1])
+
+    def render(self):
+        lines = []
+        for metric in vars(self).values():
+            lines.append('# HELP {} {}'.format(metric.name, metric.help))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.type))
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+def timed_call(backend):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return f(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                if has_app_context():
+                    current_app.metrics.search_calls.observe(
+                        elapsed, backend=backend, operation=f.__name__)
+                if has_request_context():
+                    g.search_duration = g.get('search_duration', 0) + elapsed
+        return wrapper
+    return decorator
+
+
+def _before_render(sender, template, context, **extra):
+    _local.__dict__.setdefault('renders', []).append(time.perf_counter())
+
+
+def _rendered(sender, template, context, **extra):
+    renders = getattr(_local, 'renders', None)
+    if not renders:
+        return
+    elapsed = time.perf_counter() - renders.pop()
+    # Templates rendered from inside another template are already counted.
+    if not renders and has_request_context():
+        g.render_duration = g.get('render_duration', 0) + elapsed
+
+
+def _start_request():
+    _local.renders = []
+    g.request_start = time.perf_counter()
+    g.render_duration = g.search_duration = 0
+    g._query_counter = count_queries()
+    g.query_counter = g._query_counter.__enter__()
+
+
+def _check_budget(response):
+    counter = g.get('query_counter')
+    view = current_app.view_functions.get(request.endpoint)
+    limit = getattr(view, 'query_budget', None)
+    if counter is None or limit is None:
+        return response
+    try:
+        assert_max_queries(limit, counter, request.endpoint)
+    except QueryBudgetExceeded as e:
+        if current_app.testing or current_app.config['QUERY_BUDGET_ENFORCE']:
+            raise
+        current_app.logger.warning(str(e))
+    return response
+
+
+def _record_request(response):
+    if 'request_start' not in g:
+        return response
+    elapsed = time.perf_counter() - g.request_start
+    endpoint = request.endpoint or 'unmatched'
+    counter = g.get('query_counter')
+    metrics = current_app.metrics
+    metrics.requests.inc(endpoint=endpoint, method=request.method,
+                         status=response.status_code)
+    metrics.request_duration.observe(elapsed, endpoint=endpoint)
+    metrics.render_duration.observe(g.get('render_duration', 0),
+                                    endpoint=endpoint)
+    metrics.search_duration.observe(g.get('search_duration', 0),
+                                    endpoint=endpoint)
+    if counter is not None:
+        metrics.sql_statements.observe(counter.count, endpoint=endpoint)
+        metrics.sql_duration.observe(counter.duration, endpoint=endpoint)
+    threshold = current_app.config['SLOW_REQUEST_THRESHOLD']
+    if threshold and elapsed >= threshold:
+        current_app.logger.warning(
+            'Slow request %s %s (%s): %.1fms total, %.1fms in %d SQL '
+            'statements, %.1fms rendering, %.1fms searching%s',
+            request.method, request.full_path.rstrip('?'), endpoint, elapsed * 1000,
+            counter.duration * 1000 if counter else 0,
+            counter.count if counter else 0,
+            g.get('render_duration', 0) * 1000,
+            g.get('search_duration', 0) * 1000,
+            ''.join('\n  {:8.2f}ms  {}'.format(seconds * 1000, statement)
+                    for statement, seconds in counter.timings)
+            if counter else '')
+    return response
+
+
+def metrics():
+    return current_app.response_class(
+        current_app.metrics.render(),
+        mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _end_request(exc):
+    if g.get('_query_counter') is not None:
+        g._query_counter.__exit__(None, None, None)
+
+
+def init_app(app):
+    for name, listener in (('before_cursor_execute', _before_cursor_execute),
+                           ('after_cursor_execute', _after_cursor_execute)):
+        if not sa.event.contains(sa.engine.Engine, name, listener):
+            sa.event.listen(sa.engine.Engine, name, listener)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.metrics = Metrics()
+    app.before_request(_start_request)
+    app.after_request(_record_request)
+    app.after_request(_check_budget)
+    app.teardown_request(_end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
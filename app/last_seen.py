@@ -0,0 +1,77 @@
+import atexit
+import threading
+import time
+import weakref
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from app import db
+
+# Buffers are only weakly held here, so an app that is thrown away (as
+# tests do) is not kept alive until exit just to flush it.
+_buffers = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for buffer in list(_buffers):
+        buffer._flush_in_context()
+
+
+class LastSeenBuffer:
+    def __init__(self, app):
+        self.app = app
+        self.granularity = timedelta(
+            seconds=app.config['LAST_SEEN_GRANULARITY'])
+        self.flush_interval = app.config['LAST_SEEN_FLUSH_INTERVAL']
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        _buffers.add(self)
+
+    def get(self, user):
+        last_seen = self._pending.get(user.id, user.last_seen)
+        if last_seen is not None and last_seen.tzinfo is None:
+            last_seen = last_seen.replace(tzinfo=timezone.utc)
+        return last_seen
+
+    def record(self, user):
+        now = datetime.now(timezone.utc)
+        last_seen = self.get(user)
+        if last_seen is not None and now - last_seen < self.granularity:
+            return
+        with self._lock:
+            self._pending[user.id] = now
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='last-seen', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self._flush_in_context()
+
+    def flush(self):
+        from app.models import User
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        table = User.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(
+                    sa.update(table)
+                    .where(table.c.id == sa.bindparam('user_id'))
+                    .values(last_seen=sa.bindparam('seen')),
+                    [{'user_id': id, 'seen': seen}
+                     for id, seen in pending.items()])
+        except sa.exc.DBAPIError:
+            self.app.logger.exception('Could not flush last_seen updates')
+            with self._lock:
+                for id, seen in pending.items():
+                    self._pending.setdefault(id, seen)
+
+    def _flush_in_context(self):
+        with self.app.app_context():
+            self.flush()
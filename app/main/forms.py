@@ -1,7 +1,7 @@
 from flask_wtf import FlaskForm
 from flask_babel import lazy_gettext as _l
-from wtforms import StringField, SubmitField, TextAreaField
-from wtforms.validators import DataRequired, Length, Regexp
+from wtforms import IntegerField, StringField, SubmitField, TextAreaField
+from wtforms.validators import DataRequired, Length, NumberRange, Optional, Regexp
 from flask import request
        
 class EditProfileForm(FlaskForm):
@@ -14,17 +14,25 @@ class RecipeForm(FlaskForm):
     submit = SubmitField(_l('Submit'))
 
 class IngredientForm(FlaskForm):
-    description = StringField(_l('Ingredient'), validators=[DataRequired()])
+    description = StringField(_l('Ingredient'), validators=[DataRequired()],
+                              render_kw={'data-autocomplete': 'ingredient'})
     quantity = StringField(_l('Quantity'), validators=[Regexp(regex='^[0-9]*$', message='Enter a valid quantity')])
     unit = StringField(_l('Unit'))
     submit = SubmitField(_l('Add'))
 
+class IngredientListForm(FlaskForm):
+    ingredients = TextAreaField(_l('Ingredients (one per line, e.g. "2 cups flour")'),
+                                render_kw={'rows': 10})
+    submit = SubmitField(_l('Save list'))
+
 class RecipeMethodForm(FlaskForm):
     method = TextAreaField(_l('Method'), validators=[Length(min=0, max=1024)])
+    servings = IntegerField(_l('Servings'), validators=[Optional(), NumberRange(min=1, max=100)])
     submit = SubmitField(_l('Submit'))
 
 class SearchForm(FlaskForm):
-    q = StringField(_l('Search'), validators=[DataRequired()])
+    q = StringField(_l('Search'), validators=[DataRequired()],
+                    render_kw={'data-autocomplete': 'title'})
 
     def __init__(self, *args, **kwargs):
         if 'formdata' not in kwargs:
@@ -32,3 +40,15 @@ class SearchForm(FlaskForm):
         if 'meta' not in kwargs:
             kwargs['meta'] = {'csrf': False}
         super(SearchForm, self).__init__(*args, **kwargs)
+
+class PantryForm(FlaskForm):
+    ingredients = TextAreaField(_l('What is in your pantry? (one per line or comma separated)'),
+                                validators=[DataRequired()])
+    submit = SubmitField(_l('Find recipes'))
+
+    def __init__(self, *args, **kwargs):
+        if 'formdata' not in kwargs:
+            kwargs['formdata'] = request.args
+        if 'meta' not in kwargs:
+            kwargs['meta'] = {'csrf': False}
+        super(PantryForm, self).__init__(*args, **kwargs)
@@ -1,34 +1,57 @@
-from datetime import datetime, timezone
+from datetime import timezone
+import hashlib
+import math
 import os
-from flask import abort, current_app, flash, redirect, render_template, request, url_for, g
+import re
+from flask import abort, current_app, flash, jsonify, make_response, redirect, render_template, request, send_from_directory, session, url_for, g
 from flask_babel import _, get_locale
-from app.main.forms import EditProfileForm, IngredientForm, RecipeMethodForm, RecipeForm
+from markupsafe import Markup
+from app.main.forms import EditProfileForm, IngredientForm, IngredientListForm, PantryForm, RecipeMethodForm, RecipeForm
 from flask_login import current_user, login_required
 import sqlalchemy as sa
 from app import db
-from app.models import Ingredient, Recipe, User
+from app.models import Ingredient, Recipe, UnknownIngredient, User
 from app.main import bp
+from app.cache import cached_fragment
+from app.images import InvalidImage
+from app.instrumentation import query_budget
+from app.pagination import keyset_paginate
+from app.replicas import read_replica
+from app.search import SearchUnavailable
+from app.shopping import shopping_list as aggregate_shopping_list
+from app.units import format_ingredient, parse_ingredient, scale_ingredients
 from app.main.forms import SearchForm
 
 @bp.route('/user/<username>')
 @login_required
+@read_replica
+@query_budget(6)
 def user(username):
-    page = request.args.get('page', 1, type=int)
     user = db.first_or_404(sa.select(User).where(User.username == username))
-    query = user.recipes.select().order_by(Recipe.timestamp.desc())
-    recipes = db.paginate(query, page=page,
-                        per_page=current_app.config['RECIPES_PER_PAGE'], error_out=False)
-    next_url = url_for('main.index', page=recipes.next_num) \
-        if recipes.has_next else None
-    prev_url = url_for('main.index', page=recipes.prev_num) \
-        if recipes.has_prev else None
-    return render_template('user.html', user=user, recipes=recipes.items, next_url=next_url, prev_url=prev_url)
+    query = Recipe.list_query().where(Recipe.user_id == user.id)
+    recipes = keyset_paginate(query, Recipe.timestamp, Recipe.id,
+                              current_app.config['RECIPES_PER_PAGE'],
+                              after=request.args.get('after'),
+                              before=request.args.get('before'),
+                              factory=Recipe.from_row)
+    next_url = url_for('main.user', username=user.username,
+                       after=recipes.next_cursor) if recipes.has_next else None
+    prev_url = url_for('main.user', username=user.username,
+                       before=recipes.prev_cursor) if recipes.has_prev else None
+    return render_template('user.html', user=user, last_seen=current_app.last_seen.get(user),
+                           recipes=recipes.items, next_url=next_url, prev_url=prev_url)
+
+@bp.app_template_global()
+def recipe_row(recipe):
+    return cached_fragment(
+        'recipe_row', recipe.id,
+        (recipe.version, recipe.creator.username, recipe.ingredient_count),
+        lambda: render_template('_recipe_details.html', recipe=recipe))
 
 @bp.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.now(timezone.utc)
-        db.session.commit()
+        current_app.last_seen.record(current_user)
         g.search_form = SearchForm()
         g.locale = str(get_locale())
 
@@ -51,21 +74,24 @@ def edit_profile():
 @bp.route('/', methods=['GET', 'POST'])
 @bp.route('/index', methods=['GET', 'POST'])
 @login_required
+@read_replica
+@query_budget(6)
 def index():
     form = RecipeForm()
-    page = request.args.get('page', 1, type=int)
     if form.validate_on_submit():
         recipe = Recipe(title=form.title.data, creator=current_user)
         db.session.add(recipe)
         db.session.commit()
         flash(_('Your recipe has been added!'))
         return redirect(url_for('main.recipe_ingredients', id=recipe.id))
-    query = Recipe.query.order_by(Recipe.timestamp.desc())
-    recipes = db.paginate(query, page=page,
-                        per_page=current_app.config['RECIPES_PER_PAGE'], error_out=False)
-    next_url = url_for('main.index', page=recipes.next_num) \
+    recipes = keyset_paginate(Recipe.list_query(), Recipe.timestamp, Recipe.id,
+                              current_app.config['RECIPES_PER_PAGE'],
+                              after=request.args.get('after'),
+                              before=request.args.get('before'),
+                              factory=Recipe.from_row)
+    next_url = url_for('main.index', after=recipes.next_cursor) \
         if recipes.has_next else None
-    prev_url = url_for('main.index', page=recipes.prev_num) \
+    prev_url = url_for('main.index', before=recipes.prev_cursor) \
         if recipes.has_prev else None
     return render_template("index.html", title=_('Home Page'), form=form,
                            recipes=recipes.items, next_url=next_url, prev_url=prev_url)
@@ -76,54 +102,276 @@ def recipe_ingredients(id):
     ingredient_form = IngredientForm()
     recipe = db.first_or_404(sa.select(Recipe).where(Recipe.id == id))
     if ingredient_form.validate_on_submit():
-        ingredient = Ingredient(description=ingredient_form.description.data, quantity=ingredient_form.quantity.data, unit=ingredient_form.unit.data, recipe=recipe)
-        db.session.add(ingredient)
-        db.session.commit()
+        ingredient = Ingredient(description=ingredient_form.description.data, quantity=ingredient_form.quantity.data, unit=ingredient_form.unit.data, recipe_id=recipe.id)
+        current_app.writer.run(lambda: db.session.add(ingredient))
         return redirect(url_for('main.recipe_ingredients', id=recipe.id))
-    ingredients = db.session.scalars(recipe.ingredients.select()).all()
-    return render_template('ingredients.html', recipe=recipe, ingredients=ingredients, ingredient_form=ingredient_form)
+    ingredients_html = cached_fragment(
+        'edit_ingredients', recipe.id, recipe.version,
+        lambda: render_template('_edit_ingredient_list.html', ingredients=db.session.scalars(
+            recipe.ingredients.select()).all()))
+    list_form = None
+    if request.args.get('edit') and recipe.creator == current_user:
+        list_form = IngredientListForm()
+        list_form.ingredients.data = '\n'.join(
+            format_ingredient(i.quantity, i.unit, i.description)
+            for i in db.session.scalars(recipe.ingredients.select()))
+    return render_template('ingredients.html', recipe=recipe, ingredients_html=ingredients_html,
+                           ingredient_form=ingredient_form, list_form=list_form)
+
+def ingredient_items(data):
+    if isinstance(data, dict):
+        data = data.get('ingredients')
+    if not isinstance(data, list):
+        raise ValueError('Expected a list of ingredients')
+    items = []
+    for item in data:
+        if not isinstance(item, dict):
+            raise ValueError('Expected an ingredient object')
+        id, description, quantity, unit = (item.get(name) for name in (
+            'id', 'description', 'quantity', 'unit'))
+        if id is not None and not isinstance(id, int):
+            raise ValueError('Invalid ingredient id')
+        if not isinstance(description, str) or not 0 < len(description.strip()) <= 64:
+            raise ValueError('Invalid ingredient description')
+        if quantity is not None and (isinstance(quantity, bool) or
+                                     not isinstance(quantity, (int, float)) or
+                                     not math.isfinite(quantity)):
+            raise ValueError('Invalid ingredient quantity')
+        if unit is not None and (not isinstance(unit, str) or len(unit) > 64):
+            raise ValueError('Invalid ingredient unit')
+        items.append({'id': id, 'description': description.strip(),
+                      'quantity': quantity, 'unit': unit or ''})
+    return items
+
+def batch_error(message, id):
+    if request.is_json:
+        return jsonify(error=message), 400
+    flash(message)
+    return redirect(url_for('main.recipe_ingredients', id=id))
+
+@bp.route('/recipe_ingredients/<id>/batch', methods=['POST'])
+@login_required
+def edit_ingredients(id):
+    recipe = db.first_or_404(sa.select(Recipe).where(Recipe.id == id))
+    if recipe.creator != current_user:
+        abort(403)
+    recipe_id = recipe.id
+    try:
+        if request.is_json:
+            items = ingredient_items(request.get_json())
+        else:
+            form = IngredientListForm()
+            if not form.validate_on_submit():
+                abort(400)
+            items = []
+            for line in (form.ingredients.data or '').splitlines():
+                quantity, unit, description = parse_ingredient(line)
+                if description:
+                    items.append({'description': description[:64],
+                                  'quantity': quantity, 'unit': unit})
+    except ValueError as e:
+        return batch_error(str(e), recipe_id)
+    if len(items) > current_app.config['INGREDIENTS_PER_RECIPE']:
+        return batch_error('Too many ingredients', recipe_id)
+    try:
+        added, updated, deleted = current_app.writer.run(
+            lambda: db.session.get(Recipe, recipe_id).replace_ingredients(items))
+    except UnknownIngredient as e:
+        db.session.rollback()
+        return batch_error(str(e), recipe_id)
+    if request.is_json:
+        return jsonify(added=added, updated=updated, deleted=deleted)
+    flash(_('Ingredients saved: %(added)d added, %(updated)d changed, %(deleted)d removed.',
+            added=added, updated=updated, deleted=deleted))
+    return redirect(url_for('main.recipe_ingredients', id=recipe_id))
+
+def not_modified(etag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    return request.if_modified_since is not None and \
+        last_modified <= request.if_modified_since
 
 @bp.route('/recipe/<id>', methods=['GET', 'POST'])
 @login_required
+@read_replica
 def recipe(id):
     recipe_method_form = RecipeMethodForm()
     recipe = db.first_or_404(sa.select(Recipe).where(Recipe.id == id))
+    etag = None
+    similar = current_app.similar_index.similar(
+        recipe.id, current_app.config['SIMILAR_RESULTS'])
     if recipe_method_form.validate_on_submit():
+        changes = {'method': recipe_method_form.method.data,
+                   'servings': recipe_method_form.servings.data}
         uploaded_file = request.files['image_file']
         if uploaded_file.filename != '':
-            file_ext = os.path.splitext(uploaded_file.filename)[1]
+            file_ext = os.path.splitext(uploaded_file.filename)[1].lower()
             if file_ext not in current_app.config['UPLOAD_EXTENSIONS']:
                 abort(400)
-            uploaded_file.save(os.path.join(current_app.config['UPLOAD_PATH'], str(recipe.id)))
-        recipe.method = recipe_method_form.method.data
-        db.session.commit()
+            try:
+                changes['image'] = current_app.images.save(uploaded_file, file_ext)
+            except InvalidImage:
+                abort(400)
+        recipe_id = recipe.id
+
+        def update_recipe():
+            recipe = db.session.get(Recipe, recipe_id)
+            for name, value in changes.items():
+                setattr(recipe, name, value)
+        current_app.writer.run(update_recipe)
         return redirect(url_for('main.recipe', id=recipe.id))
     elif request.method == 'GET':
         recipe_method_form.method.data = recipe.method
-    ingredients = db.session.scalars(recipe.ingredients.select()).all()
-    return render_template('recipe.html', recipe=recipe, ingredients=ingredients, recipe_method_form=recipe_method_form)
+        recipe_method_form.servings.data = recipe.servings
+        if recipe.user_id != current_user.id and '_flashes' not in session:
+            last_modified = recipe.version.replace(tzinfo=timezone.utc,
+                                                   microsecond=0)
+            etag = hashlib.sha1('{}:{}:{}:{}:{}:{}'.format(
+                recipe.id, recipe.version.isoformat(), current_user.username,
+                g.get('locale'), recipe.id in session.get('meal_plan', []),
+                [id for id, _ in similar]).encode()).hexdigest()
+            if not_modified(etag, last_modified):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+    servings = request.args.get('servings', type=int)
+    metric = request.args.get('metric') == '1'
+    factor = servings / recipe.servings \
+        if servings and recipe.servings and 0 < servings <= 100 else 1
+    if factor != 1 or metric:
+        ingredients_html = Markup(render_template('_ingredient_list.html', ingredients=scale_ingredients(
+            db.session.scalars(recipe.ingredients.select()).all(), factor, metric)))
+    else:
+        ingredients_html = cached_fragment(
+            'ingredients', recipe.id, recipe.version,
+            lambda: render_template('_ingredient_list.html', ingredients=db.session.scalars(recipe.ingredients.select()).all()))
+    if similar:
+        titles = dict(db.session.execute(sa.select(Recipe.id, Recipe.title).where(
+            Recipe.id.in_([id for id, _ in similar]))).all())
+        similar = [(id, titles[id], score) for id, score in similar if id in titles]
+    response = make_response(render_template('recipe.html', recipe=recipe, ingredients_html=ingredients_html, recipe_method_form=recipe_method_form, similar=similar,
+                                             servings=servings if factor != 1 else recipe.servings, metric=metric))
+    if etag is not None:
+        response.set_etag(etag)
+        response.last_modified = last_modified
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    return response
+
+@bp.route('/images/<image>/<name>')
+def image(image, name):
+    found = current_app.images.locate(image, name) \
+        if re.fullmatch(r'[0-9a-f]{64}\.\w+', image) and \
+        re.fullmatch(r'\w+\.\w+', name) else None
+    if found is None:
+        abort(404)
+    directory, filename, ready = found
+    response = send_from_directory(directory, filename,
+                                   max_age=31536000 if ready else 0)
+    if ready:
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
 
 @bp.route('/delete_ingredient/<id>', methods=['GET'])
 @login_required
 def delete_ingredient(id):
     ingredient = db.first_or_404(sa.select(Ingredient).where(Ingredient.id == id))
-    recipe = ingredient.recipe
-    Ingredient.query.filter_by(id=id).delete()
-    db.session.commit()
-    return redirect(url_for('main.recipe', id=recipe.id))
+    if ingredient.recipe.creator != current_user:
+        abort(403)
+    recipe_id = current_app.writer.run(lambda: Ingredient.remove(id))
+    if recipe_id is None:
+        abort(404)
+    return redirect(url_for('main.recipe', id=recipe_id))
 
 @bp.route('/search')
 @login_required
+@read_replica
+@query_budget(2)
 def search():
     if not g.search_form.validate():
         return redirect(url_for('main.explore'))
     page = request.args.get('page', 1, type=int)
-    recipes, total = Recipe.search(g.search_form.q.data, page,
-                               current_app.config['RECIPES_PER_PAGE'])
+    try:
+        recipes, total = Recipe.search(g.search_form.q.data, page,
+                                   current_app.config['RECIPES_PER_PAGE'])
+    except SearchUnavailable as e:
+        response = make_response(render_template(
+            'search.html', title=_('Search'), recipes=[], unavailable=True),
+            503)
+        response.headers['Retry-After'] = str(int(e.retry_after or 0) + 1)
+        return response
     next_url = url_for('main.search', q=g.search_form.q.data, page=page + 1) \
         if total > page * current_app.config['RECIPES_PER_PAGE'] else None
     prev_url = url_for('main.search', q=g.search_form.q.data, page=page - 1) \
         if page > 1 else None
     return render_template('search.html', title=_('Search'), recipes=recipes,
                            next_url=next_url, prev_url=prev_url)
-    
\ No newline at end of file
+
+@bp.route('/pantry')
+@login_required
+def pantry():
+    form = PantryForm()
+    matches = []
+    if form.validate():
+        ingredients = re.split(r'[,\n]', form.ingredients.data)
+        matches = Recipe.cookable(ingredients,
+                                  current_app.config['PANTRY_RESULTS'])
+    return render_template('pantry.html', title=_('What can I cook?'),
+                           form=form, matches=matches)
+
+@bp.route('/meal_plan/add/<int:id>')
+@login_required
+def add_to_meal_plan(id):
+    recipe = db.first_or_404(sa.select(Recipe).where(Recipe.id == id))
+    plan = session.get('meal_plan', [])
+    if recipe.id not in plan:
+        if len(plan) >= current_app.config['MEAL_PLAN_SIZE']:
+            flash(_('Your meal plan is full.'))
+        else:
+            session['meal_plan'] = plan + [recipe.id]
+    return redirect(url_for('main.recipe', id=recipe.id))
+
+@bp.route('/meal_plan/remove/<int:id>')
+@login_required
+def remove_from_meal_plan(id):
+    session['meal_plan'] = [recipe_id for recipe_id in session.get('meal_plan', [])
+                            if recipe_id != id]
+    return redirect(url_for('main.shopping_list'))
+
+@bp.route('/meal_plan/clear')
+@login_required
+def clear_meal_plan():
+    session.pop('meal_plan', None)
+    return redirect(url_for('main.shopping_list'))
+
+@bp.route('/shopping_list')
+@login_required
+@query_budget(4)
+def shopping_list():
+    plan = session.get('meal_plan', [])
+    recipes = []
+    items = []
+    if plan:
+        recipes = db.session.execute(sa.select(Recipe.id, Recipe.title).where(
+            Recipe.id.in_(plan)).order_by(Recipe.title)).all()
+        items = aggregate_shopping_list(db.session.execute(
+            sa.select(Ingredient.recipe_id, Ingredient.description,
+                      Ingredient.quantity, Ingredient.unit)
+            .where(Ingredient.recipe_id.in_(plan))))
+    return render_template('shopping_list.html', title=_('Shopping list'),
+                           recipes=recipes, items=items)
+
+@bp.route('/autocomplete')
+@login_required
+@query_budget(3)
+def autocomplete():
+    suggestions = current_app.autocomplete.complete(
+        request.args.get('kind', 'title'), request.args.get('q', ''),
+        request.args.get('limit', type=int))
+    response = jsonify(suggestions=suggestions)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
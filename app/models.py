@@ -1,3 +1,4 @@
+from collections import defaultdict, namedtuple
 from datetime import datetime, timezone
 from typing import Optional
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -5,49 +6,134 @@ import sqlalchemy as sa
 import sqlalchemy.orm as so
 from app import db, login
 from flask_login import UserMixin
-from app.search import add_to_index, remove_from_index, query_index
+from flask import current_app
+from app.cache import invalidate_recipes
+from app.search import query_index, search_document
+from app.units import format_ingredient, normalize_unit
+
+# Read-only records for list pages. They carry only what recipe rows show
+# and skip the identity map, change tracking and lazy loading of entities.
+RecipeResult = namedtuple('RecipeResult', ['id', 'title', 'creator',
+                                           'ingredient_count', 'version',
+                                           'timestamp'], defaults=[None])
+UserResult = namedtuple('UserResult', ['username'])
+
+class UnknownIngredient(Exception):
+    pass
 
 class SearchableMixin(object):
     @classmethod
     def search(cls, expression, page, per_page):
-        ids, total = query_index(cls.__tablename__, expression, page, per_page)
-        if total == 0:
-            return [], 0
-        when = []
-        for i in range(len(ids)):
-            when.append((ids[i], i))
-        query = sa.select(cls).where(cls.id.in_(ids)).order_by(
-            db.case(*when, value=cls.id))
-        return db.session.scalars(query), total
+        cache = current_app.search_cache
+        key = (cls.__tablename__, cache.generation, expression, page, per_page)
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+        hits, total = query_index(cls.__tablename__, expression, page,
+                                  per_page, cls.__searchable__)
+        # Results are rendered from the stored documents, so the page needs
+        # no SQL and the cache only goes stale when the index changes.
+        results = [cls.from_document(id, document) for id, document in hits]
+        cache.set(key, (results, total))
+        return results, total
 
     @classmethod
-    def before_commit(cls, session):
-        session._changes = {
-            'add': list(session.new),
-            'update': list(session.dirty),
-            'delete': list(session.deleted)
-        }
+    def search_documents(cls, ids):
+        objs = db.session.scalars(sa.select(cls).where(cls.id.in_(ids)))
+        return [(obj.id, search_document(obj)) for obj in objs]
 
     @classmethod
-    def after_commit(cls, session):
-        for obj in session._changes['add']:
-            if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['update']:
+    def dependent_ids(cls, objs):
+        return None
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        if not current_app.search_backend:
+            return
+        entries = []
+        others = []
+        for obj in session.new | session.dirty:
             if isinstance(obj, SearchableMixin):
-                add_to_index(obj.__tablename__, obj)
-        for obj in session._changes['delete']:
+                entries.append({'index_name': obj.__tablename__,
+                                'object_id': obj.id, 'operation': 'index'})
+            else:
+                others.append(obj)
+        for obj in session.deleted:
             if isinstance(obj, SearchableMixin):
-                remove_from_index(obj.__tablename__, obj)
-        session._changes = None
+                entries.append({'index_name': obj.__tablename__,
+                                'object_id': obj.id, 'operation': 'delete'})
+            else:
+                others.append(obj)
+        # Documents can include data from other models, so changes to those
+        # re-emit the documents that embed them.
+        for model in SearchableMixin.__subclasses__():
+            query = model.dependent_ids(others) if others else None
+            if query is not None:
+                entries += [{'index_name': model.__tablename__, 'object_id': id,
+                             'operation': 'index'}
+                            for id in session.scalars(query)]
+        if entries:
+            session.connection().execute(sa.insert(SearchOutbox), entries)
+            session.info['search_outbox'] = True
+
+    @classmethod
+    def after_commit(cls, session):
+        if session.info.pop('search_outbox', False):
+            current_app.search_indexer.notify()
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search_outbox', None)
 
     @classmethod
-    def reindex(cls):
-        for obj in db.session.scalars(sa.select(cls)):
-            add_to_index(cls.__tablename__, obj)
+    def reindex(cls, **kwargs):
+        from app.indexer import reindex
+        reindex(cls, **kwargs)
 
-db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
 db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
+
+class AutocompleteMixin(object):
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        changes = []
+        for obj in session.new | session.deleted:
+            if isinstance(obj, AutocompleteMixin):
+                delta = -1 if obj in session.deleted else 1
+                for attr, kind in obj.__autocomplete__.items():
+                    changes.append((kind, getattr(obj, attr), delta))
+        for obj in session.dirty:
+            if isinstance(obj, AutocompleteMixin):
+                state = sa.inspect(obj)
+                for attr, kind in obj.__autocomplete__.items():
+                    history = state.attrs[attr].history
+                    changes += [(kind, text, -1) for text in history.deleted]
+                    changes += [(kind, text, 1) for text in history.added]
+        if changes:
+            session.info.setdefault('autocomplete', []).extend(changes)
+
+    @classmethod
+    def after_commit(cls, session):
+        changes = session.info.pop('autocomplete', None)
+        if changes:
+            current_app.autocomplete.update(changes)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('autocomplete', None)
+
+db.event.listen(db.session, 'after_flush', AutocompleteMixin.after_flush)
+db.event.listen(db.session, 'after_commit', AutocompleteMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', AutocompleteMixin.after_rollback)
+
+class SearchOutbox(db.Model):
+    id: so.Mapped[int] = so.mapped_column(primary_key=True)
+    index_name: so.Mapped[str] = so.mapped_column(sa.String(64))
+    object_id: so.Mapped[int] = so.mapped_column()
+    operation: so.Mapped[str] = so.mapped_column(sa.String(16))
+    timestamp: so.Mapped[datetime] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc))
 
 class User(UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
@@ -76,14 +162,19 @@ class User(UserMixin, db.Model):
     def load_user(id):
         return db.session.get(User, int(id))
     
-class Recipe(SearchableMixin, db.Model):
-    __searchable__ = ['title']
-    __searchable__ = ['method']
+class Recipe(SearchableMixin, AutocompleteMixin, db.Model):
+    __searchable__ = {'title': 4, 'ingredients': 2, 'creator': 2, 'method': 1}
+    __autocomplete__ = {'title': 'title'}
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     title: so.Mapped[str] = so.mapped_column(sa.String(64))
     method: so.Mapped[Optional[str]] = so.mapped_column(sa.String(1024))
+    image: so.Mapped[Optional[str]] = so.mapped_column(sa.String(72))
+    servings: so.Mapped[Optional[int]] = so.mapped_column()
     timestamp: so.Mapped[datetime] = so.mapped_column(
         index=True, default=lambda: datetime.now(timezone.utc))
+    updated: so.Mapped[Optional[datetime]] = so.mapped_column(
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc))
     user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id),
                                                index=True)
 
@@ -93,8 +184,176 @@ class Recipe(SearchableMixin, db.Model):
 
     def __repr__(self):
         return '<Reciple {}>'.format(self.title)
+
+    @classmethod
+    def list_query(cls):
+        count = sa.select(sa.func.count(Ingredient.id)).where(
+            Ingredient.recipe_id == cls.id).scalar_subquery()
+        return sa.select(cls.id, cls.title, cls.timestamp, cls.updated,
+                         User.username, count.label('ingredient_count')) \
+            .join(cls.creator)
+
+    @classmethod
+    def from_row(cls, row):
+        return RecipeResult(row.id, row.title, UserResult(row.username),
+                            row.ingredient_count, row.updated or row.timestamp,
+                            row.timestamp)
+
+    @classmethod
+    def search_documents(cls, ids):
+        ingredients = defaultdict(list)
+        for recipe_id, description in db.session.execute(
+                sa.select(Ingredient.recipe_id, Ingredient.description)
+                .where(Ingredient.recipe_id.in_(ids)).order_by(Ingredient.id)):
+            ingredients[recipe_id].append(description)
+        rows = db.session.execute(
+            sa.select(cls.id, cls.title, cls.method, cls.timestamp,
+                      cls.updated, User.username)
+            .join(cls.creator).where(cls.id.in_(ids)))
+        # Text fields are searched. The others are only stored, for
+        # rendering results straight from the hits.
+        return [(row.id, {
+            'title': row.title,
+            'ingredients': '\n'.join(ingredients[row.id]),
+            'creator': row.username,
+            'method': row.method,
+            'ingredient_count': len(ingredients[row.id]),
+            'version': (row.updated or row.timestamp).replace(
+                tzinfo=timezone.utc).timestamp(),
+        }) for row in rows]
+
+    @classmethod
+    def from_document(cls, id, document):
+        version = document.get('version')
+        if version is not None:
+            version = datetime.fromtimestamp(
+                version, timezone.utc).replace(tzinfo=None)
+        return RecipeResult(id, document.get('title'),
+                            UserResult(document.get('creator')),
+                            document.get('ingredient_count'), version)
+
+    @classmethod
+    def dependent_ids(cls, objs):
+        recipe_ids = {obj.recipe_id for obj in objs
+                      if isinstance(obj, Ingredient)}
+        user_ids = {obj.id for obj in objs if isinstance(obj, User) and
+                    sa.inspect(obj).attrs.username.history.has_changes()}
+        if not recipe_ids and not user_ids:
+            return None
+        return sa.select(cls.id).where(sa.or_(cls.id.in_(recipe_ids),
+                                              cls.user_id.in_(user_ids)))
+
+    @classmethod
+    def cookable(cls, ingredients, limit):
+        matches = current_app.pantry_index.search(ingredients, limit)
+        recipes = {recipe.id: recipe for recipe in db.session.scalars(
+            sa.select(cls).where(cls.id.in_([m[0] for m in matches])))}
+        return [(recipes[id], coverage, missing)
+                for id, coverage, missing in matches if id in recipes]
+
+    @property
+    def version(self):
+        return self.updated or self.timestamp
+
+    def replace_ingredients(self, items):
+        rows = db.session.execute(
+            sa.select(Ingredient.id, Ingredient.description, Ingredient.quantity,
+                      Ingredient.unit)
+            .where(Ingredient.recipe_id == self.id).order_by(Ingredient.id)).all()
+        unclaimed = {row.id: row for row in rows}
+        claimed = []
+        pending = []
+        for item in items:
+            item = dict(item, unit=normalize_unit(item.get('unit')))
+            if item.get('id') is None:
+                pending.append(item)
+            elif item['id'] in unclaimed:
+                claimed.append((unclaimed.pop(item['id']), item))
+            else:
+                raise UnknownIngredient('Unknown ingredient {}'.format(item['id']))
+        # Lines without an id keep the row they match exactly, then edit a row
+        # with the same description, so an unchanged list changes nothing.
+        for key, edit in ((lambda i: format_ingredient(
+                              i['quantity'], i['unit'], i['description']), False),
+                          (lambda i: i['description'].lower(), True)):
+            remaining = []
+            for item in pending:
+                row = next((row for row in unclaimed.values()
+                            if key(row._asdict()) == key(item)), None)
+                if row is None:
+                    remaining.append(item)
+                elif edit:
+                    claimed.append((unclaimed.pop(row.id), item))
+                else:
+                    del unclaimed[row.id]
+            pending = remaining
+        changes = []
+        updated = []
+        for row, item in claimed:
+            values = {name: item[name] for name in ('description', 'quantity',
+                                                    'unit')}
+            if values != {name: getattr(row, name) for name in values}:
+                updated.append(dict(values, id=row.id))
+                if row.description != item['description']:
+                    changes += [('ingredient', row.description, -1),
+                                ('ingredient', item['description'], 1)]
+        # Bulk statements skip the unit of work, so the hooks that follow
+        # ingredient changes are told about these ones by hand.
+        if unclaimed:
+            db.session.execute(sa.delete(Ingredient).where(
+                Ingredient.id.in_(list(unclaimed))))
+            changes += [('ingredient', row.description, -1)
+                        for row in unclaimed.values()]
+        if updated:
+            db.session.execute(sa.update(Ingredient), updated)
+        if pending:
+            db.session.execute(sa.insert(Ingredient), [
+                {'description': item['description'], 'quantity': item['quantity'],
+                 'unit': item['unit'], 'recipe_id': self.id} for item in pending])
+            changes += [('ingredient', item['description'], 1)
+                        for item in pending]
+        if pending or updated or unclaimed:
+            self.ingredients_changed(changes)
+        return len(pending), len(updated), len(unclaimed)
+
+    def ingredients_changed(self, changes):
+        # Dirtying the recipe re-indexes it and invalidates its fragments.
+        self.updated = datetime.now(timezone.utc)
+        db.session.info.setdefault('pantry_recipes', set()).add(self.id)
+        if changes:
+            db.session.info.setdefault('autocomplete', []).extend(changes)
+
+    @classmethod
+    def track_fragments(cls, session, flush_context):
+        recipe_ids = session.info.setdefault('fragment_recipes', set())
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, Recipe):
+                recipe_ids.add(obj.id)
+            elif isinstance(obj, Ingredient):
+                recipe_ids.add(obj.recipe_id)
+        # Fragments show the creator's username, so renaming a user goes
+        # stale on their own recipes only.
+        renamed = cls.dependent_ids(
+            [obj for obj in session.dirty if isinstance(obj, User)])
+        if renamed is not None:
+            recipe_ids.update(session.scalars(renamed))
+
+    @classmethod
+    def invalidate_fragments(cls, session):
+        recipe_ids = session.info.pop('fragment_recipes', None)
+        if recipe_ids:
+            invalidate_recipes(recipe_ids)
+
+    @classmethod
+    def discard_fragments(cls, session):
+        session.info.pop('fragment_recipes', None)
+
+db.event.listen(db.session, 'after_flush', Recipe.track_fragments)
+db.event.listen(db.session, 'after_commit', Recipe.invalidate_fragments)
+db.event.listen(db.session, 'after_rollback', Recipe.discard_fragments)
     
-class Ingredient(db.Model):
+class Ingredient(AutocompleteMixin, db.Model):
+    __autocomplete__ = {'description': 'ingredient'}
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     description: so.Mapped[str] = so.mapped_column(sa.String(64))
     quantity: so.Mapped[Optional[float]] = so.mapped_column(sa.Float)
@@ -108,4 +367,44 @@ class Ingredient(db.Model):
 
     def __repr__(self):
         return '<Ingredient {} - {} {}>'.format(self.description, self.quantity, self.unit)
-    
\ No newline at end of file
+
+    @so.validates('unit')
+    def validate_unit(self, key, unit):
+        return normalize_unit(unit)
+
+    @classmethod
+    def remove(cls, id):
+        row = db.session.execute(sa.delete(cls).where(cls.id == id)
+                                 .returning(cls.recipe_id, cls.description)).first()
+        if row is None:
+            return None
+        db.session.get(Recipe, row.recipe_id).ingredients_changed(
+            [('ingredient', row.description, -1)])
+        return row.recipe_id
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        changed = set()
+        for obj in session.new | session.dirty | session.deleted:
+            if isinstance(obj, Ingredient):
+                changed.add(obj.recipe_id)
+        if changed:
+            session.connection().execute(
+                sa.update(Recipe).where(Recipe.id.in_(changed))
+                .values(updated=datetime.now(timezone.utc)))
+            session.info.setdefault('pantry_recipes', set()).update(changed)
+
+    @classmethod
+    def after_commit(cls, session):
+        recipe_ids = session.info.pop('pantry_recipes', None)
+        if recipe_ids:
+            current_app.pantry_index.refresh(recipe_ids)
+            current_app.similar_index.refresh(recipe_ids)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('pantry_recipes', None)
+
+db.event.listen(db.session, 'after_flush', Ingredient.after_flush)
+db.event.listen(db.session, 'after_commit', Ingredient.after_commit)
+db.event.listen(db.session, 'after_rollback', Ingredient.after_rollback)
@@ -0,0 +1,67 @@
+import base64
+from datetime import datetime
+import sqlalchemy as sa
+from app import db
+
+
+def encode_cursor(timestamp, id):
+    raw = '{}|{}'.format(timestamp.isoformat(), id).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        timestamp, id = raw.decode().split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, items, next_cursor, prev_cursor):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+
+def keyset_paginate(query, timestamp, id, per_page, after=None, before=None,
+                    session=None, factory=None):
+    session = session or db.session
+    key = sa.tuple_(timestamp, id)
+    after = decode_cursor(after) if after else None
+    before = decode_cursor(before) if before else None
+    if before is not None:
+        query = query.where(key > sa.tuple_(*before)).order_by(
+            timestamp.asc(), id.asc())
+    else:
+        if after is not None:
+            query = query.where(key < sa.tuple_(*after))
+        query = query.order_by(timestamp.desc(), id.desc())
+    if factory is None:
+        items = session.scalars(query.limit(per_page + 1)).all()
+    else:
+        items = [factory(row) for row in session.execute(
+            query.limit(per_page + 1))]
+    more = len(items) > per_page
+    items = items[:per_page]
+    if before is not None:
+        items.reverse()
+    if not items:
+        return KeysetPage(items, None, None)
+
+    def cursor(item):
+        return encode_cursor(getattr(item, timestamp.key), getattr(item, id.key))
+
+    has_next = more if before is None else True
+    has_prev = more if before is not None else after is not None
+    return KeysetPage(items, cursor(items[-1]) if has_next else None,
+                      cursor(items[0]) if has_prev else None)
@@ -0,0 +1,218 @@
+import re
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+import sqlalchemy as sa
+from app import db
+
+
+@lru_cache(maxsize=65536)
+def normalize(description):
+    words = []
+    for word in re.findall(r'[a-z]+', description.lower()):
+        if word.endswith('ies') and len(word) > 4:
+            word = word[:-3] + 'y'
+        elif word.endswith('oes') and len(word) > 4:
+            word = word[:-2]
+        elif word.endswith('s') and not word.endswith('ss') and len(word) > 3:
+            word = word[:-1]
+        words.append(word)
+    return ' '.join(words)
+
+
+def to_bitset(ids):
+    if not ids:
+        return 0
+    bits = bytearray(max(ids) // 8 + 1)
+    for id in ids:
+        bits[id >> 3] |= 1 << (id & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def equal_to(planes, value, mask):
+    if value >> len(planes):
+        return 0
+    for bit, plane in enumerate(planes):
+        mask &= plane if value >> bit & 1 else ~plane
+    return mask
+
+
+class PantryIndex:
+    # Terms used by more than 1/DENSE_RATIO of the recipes are kept as int
+    # bitsets keyed by recipe id, rarer ones as sorted id arrays.
+    DENSE_RATIO = 64
+
+    def __init__(self, app):
+        self.app = app
+        self.max_age = app.config['PANTRY_INDEX_MAX_AGE']
+        self.loaded = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._terms = {}
+        self._sparse = {}
+        self._dense = {}
+        self._size_planes = []
+
+    def _build(self):
+        from app.models import Ingredient
+        terms = defaultdict(set)
+        with db.engine.connect() as conn:
+            rows = conn.execute(
+                sa.select(Ingredient.recipe_id, Ingredient.description)
+                .execution_options(yield_per=10000))
+            for recipe_id, description in rows:
+                term = normalize(description)
+                if term:
+                    terms[recipe_id].add(term)
+        postings = defaultdict(list)
+        for recipe_id in sorted(terms):
+            for term in terms[recipe_id]:
+                postings[term].append(recipe_id)
+        threshold = max(len(terms), 1) / self.DENSE_RATIO
+        sparse, dense = {}, {}
+        for term, ids in postings.items():
+            if len(ids) > threshold:
+                dense[term] = to_bitset(ids)
+            else:
+                sparse[term] = array('L', ids)
+        sizes = defaultdict(list)
+        for recipe_id, recipe_terms in terms.items():
+            sizes[len(recipe_terms)].append(recipe_id)
+        planes = [0] * max(sizes, default=0).bit_length()
+        for size, ids in sizes.items():
+            bits = to_bitset(ids)
+            for plane in range(len(planes)):
+                if size >> plane & 1:
+                    planes[plane] |= bits
+        return ({id: tuple(t) for id, t in terms.items()}, sparse, dense,
+                planes)
+
+    def _rebuild(self):
+        with self.app.app_context():
+            try:
+                state = self._build()
+                with self._lock:
+                    (self._terms, self._sparse, self._dense,
+                     self._size_planes) = state
+                    self.loaded = time.time()
+            finally:
+                self._rebuilding = False
+
+    def _ensure_loaded(self):
+        if self.loaded is None:
+            with self._lock:
+                if self.loaded is None:
+                    (self._terms, self._sparse, self._dense,
+                     self._size_planes) = self._build()
+                    self.loaded = time.time()
+        elif time.time() - self.loaded > self.max_age and \
+                not self._rebuilding:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _bitset(self, term):
+        if term in self._dense:
+            return self._dense[term]
+        return to_bitset(self._sparse.get(term))
+
+    def _set_size(self, recipe_id, size):
+        bit = 1 << recipe_id
+        planes = self._size_planes
+        while size.bit_length() > len(planes):
+            planes.append(0)
+        for plane in range(len(planes)):
+            if size >> plane & 1:
+                planes[plane] |= bit
+            else:
+                planes[plane] &= ~bit
+
+    def _add(self, term, recipe_id):
+        if term in self._dense:
+            self._dense[term] |= 1 << recipe_id
+            return
+        ids = self._sparse.setdefault(term, array('L'))
+        i = bisect_left(ids, recipe_id)
+        if i == len(ids) or ids[i] != recipe_id:
+            ids.insert(i, recipe_id)
+        if len(ids) > len(self._terms) / self.DENSE_RATIO:
+            self._dense[term] = to_bitset(self._sparse.pop(term))
+
+    def _remove(self, term, recipe_id):
+        if term in self._dense:
+            self._dense[term] &= ~(1 << recipe_id)
+            return
+        ids = self._sparse.get(term)
+        if ids is not None:
+            i = bisect_left(ids, recipe_id)
+            if i < len(ids) and ids[i] == recipe_id:
+                del ids[i]
+            if not ids:
+                del self._sparse[term]
+
+    def refresh(self, recipe_ids):
+        from app.models import Ingredient
+        if self.loaded is None or not recipe_ids:
+            return
+        terms = defaultdict(set)
+        with db.engine.connect() as conn:
+            for recipe_id, description in conn.execute(
+                    sa.select(Ingredient.recipe_id, Ingredient.description)
+                    .where(Ingredient.recipe_id.in_(recipe_ids))):
+                term = normalize(description)
+                if term:
+                    terms[recipe_id].add(term)
+        with self._lock:
+            for recipe_id in recipe_ids:
+                old = set(self._terms.pop(recipe_id, ()))
+                new = terms.get(recipe_id, set())
+                for term in old - new:
+                    self._remove(term, recipe_id)
+                for term in new - old:
+                    self._add(term, recipe_id)
+                if new:
+                    self._terms[recipe_id] = tuple(new)
+                self._set_size(recipe_id, len(new))
+
+    def search(self, ingredients, limit=20):
+        self._ensure_loaded()
+        available = {normalize(i) for i in ingredients} - {''}
+        # bit-sliced counters: bit i of counts[j] is bit j of the number of
+        # available ingredients recipe i uses
+        counts = []
+        for term in available:
+            carry = self._bitset(term)
+            for plane in range(len(counts)):
+                counts[plane], carry = counts[plane] ^ carry, \
+                    counts[plane] & carry
+                if not carry:
+                    break
+            if carry:
+                counts.append(carry)
+        candidates = 0
+        for plane in counts:
+            candidates |= plane
+        if not candidates:
+            return []
+        sizes = range(1, 1 << len(self._size_planes))
+        by_size = {size: equal_to(self._size_planes, size, candidates)
+                   for size in sizes}
+        by_count = {count: equal_to(counts, count, candidates)
+                    for count in range(1, len(available) + 1)}
+        pairs = sorted(((count, size) for size in sizes if by_size[size]
+                        for count in by_count if count <= size),
+                       key=lambda pair: (-pair[0] / pair[1], pair[1] - pair[0]))
+        matches = []
+        for count, size in pairs:
+            bits = by_count[count] & by_size[size]
+            while bits and len(matches) < limit:
+                recipe_id = bits.bit_length() - 1
+                bits ^= 1 << recipe_id
+                missing = [term for term in self._terms.get(recipe_id, ())
+                           if term not in available]
+                matches.append((recipe_id, count / size, sorted(missing)))
+            if len(matches) >= limit:
+                break
+        return matches
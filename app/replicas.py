@@ -0,0 +1,71 @@
+import random
+import time
+from flask import current_app, g, has_app_context, has_request_context, \
+    request, session
+from flask_sqlalchemy.session import Session
+
+
+def read_replica(f):
+    f.read_replica = True
+    return f
+
+
+def replica_keys(app):
+    return [key for key in app.config['SQLALCHEMY_BINDS']
+            if key.startswith('replica')]
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and has_app_context():
+            replica = g.get('replica')
+            if replica is not None:
+                return self._db.engines[replica]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def _choose_replica():
+    keys = replica_keys(current_app)
+    if not keys or request.method not in ('GET', 'HEAD'):
+        return
+    view = current_app.view_functions.get(request.endpoint)
+    if not getattr(view, 'read_replica', False):
+        return
+    # A client that wrote recently reads from the primary until the replicas
+    # have had time to catch up, so it always sees its own changes.
+    if session.get('primary_until', 0) > time.time():
+        return
+    g.replica = random.choice(keys)
+
+
+def _after_flush(db_session, flush_context):
+    db_session.info['replica_wrote'] = True
+    if has_app_context():
+        # The rest of the request reads from the connection that wrote.
+        g.pop('replica', None)
+
+
+def mark_written():
+    if has_request_context() and replica_keys(current_app):
+        session['primary_until'] = time.time() + \
+            current_app.config['REPLICA_LAG_WINDOW']
+
+
+def _after_commit(db_session):
+    if db_session.info.pop('replica_wrote', False):
+        mark_written()
+
+
+def _after_rollback(db_session):
+    db_session.info.pop('replica_wrote', None)
+
+
+def init_app(app):
+    from app import db
+    for name, listener in (('after_flush', _after_flush),
+                           ('after_commit', _after_commit),
+                           ('after_rollback', _after_rollback)):
+        if not db.event.contains(db.session, name, listener):
+            db.event.listen(db.session, name, listener)
+    app.before_request(_choose_replica)
@@ -1,25 +1,438 @@
+import itertools
+import logging
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from functools import wraps
 from flask import current_app
+from app.instrumentation import timed_call
 
-def add_to_index(index, model):
-    if not current_app.elasticsearch:
-        return
+logger = logging.getLogger(__name__)
+
+
+class SearchUnavailable(Exception):
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SearchSchemaChanged(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Closed until `threshold` consecutive outage errors, then open: calls
+    # fail straight away until `reset_timeout` has passed, after which a
+    # single probe is let through and either closes or re-opens the circuit.
+    def __init__(self, name, threshold=5, reset_timeout=30):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        if self._probing or \
+                time.monotonic() - self.opened < self.reset_timeout:
+            return 'open'
+        return 'half-open'
+
+    def retry_after(self):
+        if self.opened is None:
+            return 0
+        return max(0, self.reset_timeout - (time.monotonic() - self.opened))
+
+    def call(self, is_outage, f, *args, **kwargs):
+        with self._lock:
+            if self.opened is not None:
+                if self.state == 'open':
+                    raise SearchUnavailable(
+                        '{} circuit is open'.format(self.name),
+                        self.retry_after())
+                self._probing = True
+        try:
+            result = f(*args, **kwargs)
+        except Exception as e:
+            if not is_outage(e):
+                self._success()
+                raise
+            with self._lock:
+                self.failures += 1
+                self._probing = False
+                if self.opened is not None or \
+                        self.failures >= self.threshold:
+                    if self.opened is None:
+                        logger.warning(
+                            '%s circuit opened after %d failures: %s',
+                            self.name, self.failures, e)
+                    self.opened = time.monotonic()
+            raise SearchUnavailable('{} call failed: {}'.format(
+                self.name, e), self.retry_after()) from e
+        self._success()
+        return result
+
+    def _success(self):
+        with self._lock:
+            if self.opened is not None:
+                logger.info('%s circuit closed', self.name)
+            self.failures = 0
+            self.opened = None
+            self._probing = False
+
+
+def guarded(f):
+    @wraps(f)
+    def wrapper(self, *args, **kwargs):
+        return self.breaker.call(self.is_outage, f, self, *args, **kwargs)
+    return wrapper
+
+
+class ElasticsearchBackend:
+    def __init__(self, client, search_timeout=None, write_timeout=None,
+                 breaker=None):
+        self.client = client
+        self.search_timeout = search_timeout
+        self.write_timeout = write_timeout
+        self.breaker = breaker or CircuitBreaker('elasticsearch')
+
+    @staticmethod
+    def is_outage(e):
+        from elasticsearch import ApiError, TransportError
+        return isinstance(e, TransportError) or \
+            (isinstance(e, ApiError) and e.meta.status >= 500)
+
+    def _client(self, timeout):
+        if timeout is None:
+            return self.client
+        return self.client.options(request_timeout=timeout)
+
+    @guarded
+    @timed_call('elasticsearch')
+    def index(self, index, id, document):
+        self._client(self.write_timeout).index(
+            index=index, id=id, document=document)
+
+    @guarded
+    @timed_call('elasticsearch')
+    def delete(self, index, id):
+        self._client(self.write_timeout).delete(index=index, id=id)
+
+    @guarded
+    @timed_call('elasticsearch')
+    def bulk(self, index, documents, deleted=()):
+        from elasticsearch.helpers import bulk
+        client = self._client(self.write_timeout)
+        targets = [index]
+        if client.indices.exists_alias(name=index + '-building'):
+            targets.append(index + '-building')
+            documents = list(documents)
+        actions = itertools.chain.from_iterable(itertools.chain(
+            ({'_index': target, '_id': id, '_source': document}
+             for id, document in documents),
+            ({'_op_type': 'delete', '_index': target, '_id': id}
+             for id in deleted)) for target in targets)
+        bulk(client, actions, ignore_status=404)
+
+    def create_index(self, alias):
+        index = '{}-{}'.format(alias, time.strftime('%Y%m%d%H%M%S'))
+        self.client.indices.create(index=index)
+        self.client.indices.put_alias(index=index, name=alias + '-building')
+        return index
+
+    def swap_alias(self, alias, index):
+        old = []
+        if self.client.indices.exists_alias(name=alias):
+            old = list(self.client.indices.get_alias(name=alias).keys())
+        actions = [{'remove': {'index': index, 'alias': alias + '-building'}},
+                   {'add': {'index': index, 'alias': alias}}]
+        actions += [{'remove': {'index': name, 'alias': alias}}
+                    for name in old]
+        if not old and self.client.indices.exists(index=alias):
+            actions.append({'remove_index': {'index': alias}})
+        self.client.indices.update_aliases(actions=actions)
+        for name in old:
+            if name != index:
+                self.client.indices.delete(index=name)
+
+    @guarded
+    @timed_call('elasticsearch')
+    def search(self, index, query, page, per_page, fields=None):
+        search = self._client(self.search_timeout).search(
+            index=index,
+            query={'multi_match': {'query': query, 'fields': [
+                '{}^{}'.format(field, weight)
+                for field, weight in fields.items()] if fields else ['*']}},
+            from_=(page - 1) * per_page,
+            size=per_page)
+        hits = [(int(hit['_id']), hit['_source'])
+                for hit in search['hits']['hits']]
+        return hits, search['hits']['total']['value']
+
+
+class LocalSearchBackend:
+    def __init__(self, path, max_total=1000, breaker=None):
+        self.path = path
+        self.max_total = max_total
+        self.breaker = breaker or CircuitBreaker('local search')
+        self._local = threading.local()
+        self._columns = {}
+
+    @staticmethod
+    def is_outage(e):
+        return isinstance(e, sqlite3.OperationalError)
+
+    @property
+    def connection(self):
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS search_alias '
+                         '(alias TEXT PRIMARY KEY, target TEXT, building TEXT)')
+            self._local.connection = conn
+        return conn
+
+    def _targets(self, index):
+        row = self.connection.execute(
+            'SELECT target, building FROM search_alias WHERE alias = ?',
+            (index,)).fetchone()
+        if row is None:
+            return [index]
+        return [target for target in row if target]
+
+    def _table(self, index, document=None):
+        columns = self._columns.get(index)
+        if columns is None:
+            rows = self.connection.execute(
+                'PRAGMA table_info("{}")'.format(index)).fetchall()
+            columns = tuple(row[1] for row in rows) or None
+        if document is not None and columns is not None and \
+                tuple(document) != columns:
+            raise SearchSchemaChanged(
+                'Search index "{}" has fields {} but documents have {}; run '
+                '"flask reindex --fresh" to rebuild it'.format(
+                    index, ', '.join(columns), ', '.join(document)))
+        if document is not None and columns is None:
+            # Fields that are not text are stored for display, not indexed.
+            self.connection.execute(
+                'CREATE VIRTUAL TABLE "{}" USING fts5({}, '
+                'tokenize=\'porter unicode61\')'.format(
+                    index, ', '.join(
+                        '"{}"{}'.format(field, '' if value is None or
+                                        isinstance(value, str)
+                                        else ' UNINDEXED')
+                        for field, value in document.items())))
+            columns = tuple(document)
+        self._columns[index] = columns
+        return columns
+
+    def _write(self, index, documents, deleted=()):
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            targets = self._targets(index)
+            if len(targets) > 1:
+                documents = list(documents)
+            for target in targets:
+                if target != targets[-1] and documents and tuple(
+                        documents[0][1]) != self._table(target):
+                    # A fresh reindex is building the new layout into the
+                    # last target; this one is dropped when that is swapped in.
+                    pending = ()
+                else:
+                    pending = documents
+                for id, document in pending:
+                    columns = self._table(target, document)
+                    conn.execute(
+                        'INSERT OR REPLACE INTO "{}"(rowid, {}) '
+                        'VALUES (?, {})'.format(
+                            target, ', '.join('"{}"'.format(c) for c in columns),
+                            ', '.join('?' * len(columns))),
+                        [id] + ['' if document[c] is None else document[c]
+                                for c in columns])
+                if deleted and self._table(target):
+                    conn.executemany(
+                        'DELETE FROM "{}" WHERE rowid = ?'.format(target),
+                        [(id,) for id in deleted])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            self._columns.clear()
+            raise
+
+    @guarded
+    @timed_call('local')
+    def index(self, index, id, document):
+        self._write(index, [(id, document)])
+
+    @guarded
+    @timed_call('local')
+    def delete(self, index, id):
+        self._write(index, [], [id])
+
+    @guarded
+    @timed_call('local')
+    def bulk(self, index, documents, deleted=()):
+        self._write(index, documents, deleted)
+
+    def create_index(self, alias):
+        index = '{}_{}'.format(alias, time.strftime('%Y%m%d%H%M%S'))
+        self.connection.execute(
+            'INSERT INTO search_alias (alias, target, building) '
+            'VALUES (?, ?, ?) ON CONFLICT (alias) '
+            'DO UPDATE SET building = excluded.building', (alias, alias, index))
+        return index
+
+    def swap_alias(self, alias, index):
+        conn = self.connection
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            old = conn.execute('SELECT target FROM search_alias WHERE alias = ?',
+                               (alias,)).fetchone()
+            conn.execute('INSERT OR REPLACE INTO search_alias '
+                         '(alias, target, building) VALUES (?, ?, NULL)',
+                         (alias, index))
+            if old and old[0] != index:
+                conn.execute('DROP TABLE IF EXISTS "{}"'.format(old[0]))
+                self._columns.pop(old[0], None)
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+
+    @guarded
+    @timed_call('local')
+    def search(self, index, query, page, per_page, fields=None):
+        terms = set(re.findall(r'\w+', query.lower()))
+        index = self._targets(index)[0]
+        columns = self._table(index)
+        if not terms or not columns:
+            return [], 0
+        weights = [(fields or {}).get(column, 0 if fields else 1)
+                   for column in columns]
+        searched = [column for column, weight in zip(columns, weights)
+                    if weight]
+        if not searched:
+            return [], 0
+        match = ' OR '.join('"{}"'.format(term) for term in terms)
+        if fields:
+            match = '{{{}}} : ({})'.format(' '.join(searched), match)
+        conn = self.connection
+        # bm25() reads the whole doclist of every term, which grows with the
+        # index. Only the newest max_total matches are candidates instead:
+        # each scores the weight of every field a term is found in, times
+        # the term's idf estimated from how densely it matches that rowid
+        # span. The candidates are ranked as a whole before paging, so the
+        # order is the same whichever page is asked for.
+        candidates = [row[0] for row in conn.execute(
+            'SELECT rowid FROM "{0}" WHERE "{0}" MATCH ? '
+            'ORDER BY rowid DESC LIMIT ?'.format(index),
+            (match, self.max_total))]
+        total = len(candidates)
+        start = (page - 1) * per_page
+        if start >= total:
+            return [], total
+        lowest = candidates[-1] if total == self.max_total else 1
+        span = candidates[0] - lowest + 1
+        scores = dict.fromkeys(candidates, 0.0)
+        for term in terms:
+            found = {}
+            for column, weight in zip(columns, weights):
+                if weight:
+                    for row in conn.execute(
+                            'SELECT rowid FROM "{0}" WHERE "{0}" MATCH ? '
+                            'AND rowid >= ?'.format(index),
+                            ('"{}" : "{}"'.format(column, term), lowest)):
+                        found[row[0]] = found.get(row[0], 0) + weight
+            if found:
+                idf = math.log(1 + span / len(found))
+                for id, weight in found.items():
+                    scores[id] += weight * idf
+        ids = sorted(candidates, key=lambda id: (scores[id], id),
+                     reverse=True)[start:start + per_page]
+        rows = conn.execute(
+            'SELECT rowid, * FROM "{0}" WHERE rowid IN ({1})'.format(
+                index, ', '.join('?' * len(ids))), ids)
+        hits = {row[0]: dict(zip(columns, row[1:])) for row in rows}
+        return [(id, hits[id]) for id in ids if id in hits], total
+
+
+class LazyClient:
+    # Stands in for the Elasticsearch client, which is only imported and
+    # built the first time something uses it.
+    def __init__(self, factory, *args):
+        self._factory = factory
+        self._args = args
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory(*self._args)
+        return getattr(self._client, name)
+
+
+def create_client(app):
+    from elasticsearch import Elasticsearch
+    return Elasticsearch(
+        [app.config['ELASTICSEARCH_URL']],
+        request_timeout=app.config['ELASTICSEARCH_WRITE_TIMEOUT'],
+        connections_per_node=app.config['ELASTICSEARCH_POOL_SIZE'],
+        max_retries=app.config['ELASTICSEARCH_MAX_RETRIES'],
+        retry_on_timeout=False)
+
+
+def create_backend(app):
+    if app.elasticsearch:
+        breaker = CircuitBreaker('elasticsearch',
+                                 app.config['SEARCH_BREAKER_THRESHOLD'],
+                                 app.config['SEARCH_BREAKER_RESET'])
+        return ElasticsearchBackend(
+            app.elasticsearch, app.config['ELASTICSEARCH_SEARCH_TIMEOUT'],
+            app.config['ELASTICSEARCH_WRITE_TIMEOUT'], breaker)
+    if app.config['SEARCH_INDEX_PATH']:
+        os.makedirs(os.path.dirname(os.path.abspath(
+            app.config['SEARCH_INDEX_PATH'])), exist_ok=True)
+        breaker = CircuitBreaker('local search',
+                                 app.config['SEARCH_BREAKER_THRESHOLD'],
+                                 app.config['SEARCH_BREAKER_RESET'])
+        return LocalSearchBackend(app.config['SEARCH_INDEX_PATH'],
+                                  app.config['SEARCH_MAX_RESULTS'],
+                                  breaker=breaker)
+    return None
+
+
+def search_document(model):
     payload = {}
     for field in model.__searchable__:
         payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, document=payload)
+    return payload
+
+def add_to_index(index, model):
+    if not current_app.search_backend:
+        return
+    for id, document in type(model).search_documents([model.id]):
+        current_app.search_backend.index(index, id, document)
 
 def remove_from_index(index, model):
-    if not current_app.elasticsearch:
+    if not current_app.search_backend:
         return
-    current_app.elasticsearch.delete(index=index, id=model.id)
+    current_app.search_backend.delete(index, model.id)
 
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
+def query_index(index, query, page, per_page, fields=None):
+    if not current_app.search_backend:
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        query={'multi_match': {'query': query, 'fields': ['*']}},
-        from_=(page - 1) * per_page,
-        size=per_page)
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+    return current_app.search_backend.search(index, query, page, per_page,
+                                             fields)
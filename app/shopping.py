@@ -0,0 +1,46 @@
+from collections import namedtuple
+from app.pantry import normalize
+from app.units import METRIC, UNITS, round_quantity
+
+ShoppingItem = namedtuple('ShoppingItem',
+                          ['quantity', 'unit', 'description', 'recipes'])
+
+
+def shopping_list(rows):
+    # rows are (recipe_id, description, quantity, unit) tuples. Quantities in
+    # compatible units are summed in base units; unknown units only merge
+    # with the same word, ignoring plurals.
+    totals = {}
+    for recipe_id, description, quantity, unit in rows:
+        known = UNITS.get(unit)
+        name = normalize(description) or description.strip().lower()
+        key = (name, known.dimension) if known else \
+            (name, None, normalize(unit or ''))
+        entry = totals.get(key)
+        if entry is None:
+            entry = totals[key] = [description.strip(), None, set(), set()]
+        if known or not entry[2]:
+            entry[2].add(unit)
+        if quantity is not None:
+            entry[1] = (entry[1] or 0) + \
+                (quantity * known.factor if known else quantity)
+        entry[3].add(recipe_id)
+    items = []
+    for key, (description, quantity, units, recipe_ids) in totals.items():
+        if len(key) == 3:
+            unit = next(iter(units))
+        else:
+            dimension = key[1]
+            if len(units) == 1:
+                unit = next(iter(units))
+            else:
+                unit = METRIC[dimension][0][0]
+                for candidate, size in METRIC[dimension]:
+                    if quantity is not None and abs(quantity) >= size:
+                        unit = candidate
+            if quantity is not None:
+                quantity /= UNITS[unit].factor
+        items.append(ShoppingItem(round_quantity(quantity), unit, description,
+                                  len(recipe_ids)))
+    items.sort(key=lambda item: item.description.lower())
+    return items
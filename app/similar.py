@@ -0,0 +1,171 @@
+import hashlib
+import heapq
+import operator
+import struct
+import threading
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import defaultdict
+from functools import lru_cache
+import sqlalchemy as sa
+from app import db
+from app.pantry import normalize
+
+NUM_HASHES = 32
+BANDS = 8
+ROWS = NUM_HASHES // BANDS
+EMPTY = array('H', [0xFFFF]) * NUM_HASHES
+
+
+@lru_cache(maxsize=65536)
+def term_hashes(term):
+    digest = hashlib.blake2b(term.encode(), digest_size=2 * NUM_HASHES)
+    return struct.unpack('{}H'.format(NUM_HASHES), digest.digest())
+
+
+def minhash(terms):
+    if not terms:
+        return EMPTY
+    hashes = [term_hashes(term) for term in terms]
+    if len(hashes) == 1:
+        return array('H', hashes[0])
+    return array('H', map(min, *hashes))
+
+
+def band_keys(signature):
+    return [zlib.crc32(signature[band * ROWS:(band + 1) * ROWS].tobytes())
+            for band in range(BANDS)]
+
+
+class SimilarIndex:
+    # MinHash signatures are stored in one flat array indexed by recipe id.
+    # Each LSH band is a pair of parallel arrays sorted by band hash, so a
+    # bucket is a bisect away and the whole index stays a few flat buffers.
+    MAX_BUCKET = 500
+
+    def __init__(self, app):
+        self.app = app
+        self.max_age = app.config['SIMILAR_INDEX_MAX_AGE']
+        self.loaded = None
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._signatures = array('H')
+        self._band_keys = [array('I') for _ in range(BANDS)]
+        self._band_ids = [array('I') for _ in range(BANDS)]
+
+    def _load_terms(self, recipe_ids=None):
+        from app.models import Ingredient
+        terms = defaultdict(set)
+        query = sa.select(Ingredient.recipe_id, Ingredient.description)
+        if recipe_ids is None:
+            query = query.execution_options(yield_per=10000)
+        else:
+            query = query.where(Ingredient.recipe_id.in_(recipe_ids))
+        with db.engine.connect() as conn:
+            for recipe_id, description in conn.execute(query):
+                term = normalize(description)
+                if term:
+                    terms[recipe_id].add(term)
+        return terms
+
+    def _build(self):
+        terms = self._load_terms()
+        signatures = EMPTY * (max(terms, default=0) + 1)
+        entries = [[] for _ in range(BANDS)]
+        for recipe_id, recipe_terms in terms.items():
+            signature = minhash(recipe_terms)
+            start = recipe_id * NUM_HASHES
+            signatures[start:start + NUM_HASHES] = signature
+            for band, key in enumerate(band_keys(signature)):
+                entries[band].append(key << 32 | recipe_id)
+        keys, ids = [], []
+        for band_entries in entries:
+            band_entries.sort()
+            keys.append(array('I', (entry >> 32 for entry in band_entries)))
+            ids.append(array('I', (entry & 0xFFFFFFFF
+                                   for entry in band_entries)))
+        return signatures, keys, ids
+
+    def _rebuild(self):
+        with self.app.app_context():
+            try:
+                state = self._build()
+                with self._lock:
+                    self._signatures, self._band_keys, self._band_ids = state
+                    self.loaded = time.time()
+            finally:
+                self._rebuilding = False
+
+    def _ensure_loaded(self):
+        # Unlike the pantry the panel is optional, so even the first build
+        # happens in the background instead of stalling a page view.
+        if self._rebuilding:
+            return
+        if self.loaded is None or time.time() - self.loaded > self.max_age:
+            self._rebuilding = True
+            threading.Thread(target=self._rebuild, daemon=True).start()
+
+    def _signature(self, recipe_id):
+        start = recipe_id * NUM_HASHES
+        if start >= len(self._signatures):
+            return EMPTY
+        return self._signatures[start:start + NUM_HASHES]
+
+    def _insert(self, band, key, recipe_id):
+        i = bisect_right(self._band_keys[band], key)
+        self._band_keys[band].insert(i, key)
+        self._band_ids[band].insert(i, recipe_id)
+
+    def _remove(self, band, key, recipe_id):
+        keys, ids = self._band_keys[band], self._band_ids[band]
+        for i in range(bisect_left(keys, key), bisect_right(keys, key)):
+            if ids[i] == recipe_id:
+                del keys[i]
+                del ids[i]
+                return
+
+    def refresh(self, recipe_ids):
+        if self.loaded is None or not recipe_ids:
+            return
+        terms = self._load_terms(recipe_ids)
+        signatures = {id: minhash(terms.get(id)) for id in recipe_ids}
+        with self._lock:
+            for recipe_id, signature in signatures.items():
+                old = self._signature(recipe_id)
+                if old == signature:
+                    continue
+                if old != EMPTY:
+                    for band, key in enumerate(band_keys(old)):
+                        self._remove(band, key, recipe_id)
+                start = recipe_id * NUM_HASHES
+                if start >= len(self._signatures):
+                    self._signatures.extend(
+                        EMPTY * (recipe_id + 1 - len(self._signatures) //
+                                 NUM_HASHES))
+                self._signatures[start:start + NUM_HASHES] = signature
+                if signature != EMPTY:
+                    for band, key in enumerate(band_keys(signature)):
+                        self._insert(band, key, recipe_id)
+
+    def similar(self, recipe_id, limit=5):
+        self._ensure_loaded()
+        if self.loaded is None:
+            return []
+        signature = self._signature(recipe_id)
+        if signature == EMPTY:
+            return []
+        candidates = set()
+        for band, key in enumerate(band_keys(signature)):
+            keys = self._band_keys[band]
+            start = bisect_left(keys, key)
+            end = min(bisect_right(keys, key, start),
+                      start + self.MAX_BUCKET)
+            candidates.update(self._band_ids[band][start:end])
+        candidates.discard(recipe_id)
+        scored = ((sum(map(operator.eq, signature,
+                           self._signature(candidate))) / NUM_HASHES,
+                   candidate) for candidate in candidates)
+        return [(candidate, similarity) for similarity, candidate
+                in heapq.nlargest(limit, scored)]
@@ -0,0 +1,152 @@
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future
+import sqlalchemy as sa
+from app import db
+from app.replicas import mark_written
+
+
+def is_busy(e):
+    return isinstance(e, sa.exc.OperationalError) and \
+        ('database is locked' in str(e.orig) or
+         'database is busy' in str(e.orig))
+
+
+def retry_on_busy(f, retries=5, backoff=0.01, max_backoff=1):
+    for attempt in range(retries + 1):
+        try:
+            return f()
+        except sa.exc.OperationalError as e:
+            db.session.rollback()
+            if not is_busy(e) or attempt == retries:
+                raise
+        # Jitter keeps the writers that just collided from colliding again.
+        time.sleep(min(max_backoff, backoff * 2 ** attempt) *
+                   random.uniform(0.5, 1.5))
+
+
+def _connect(app):
+    pragmas = [
+        'PRAGMA journal_mode=WAL',
+        'PRAGMA synchronous=NORMAL',
+        'PRAGMA busy_timeout={}'.format(
+            int(app.config['SQLITE_BUSY_TIMEOUT'] * 1000)),
+        'PRAGMA cache_size=-{}'.format(app.config['SQLITE_CACHE_SIZE']),
+        'PRAGMA mmap_size={}'.format(app.config['SQLITE_MMAP_SIZE']),
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+    return connect
+
+
+def _begin(conn):
+    # pysqlite leaves reads outside any transaction and only begins one at
+    # the first write, which suits request threads. The group writer takes
+    # the lock up front instead, waiting for it in busy_timeout.
+    if conn.get_execution_options().get('sqlite_immediate'):
+        conn.exec_driver_sql('BEGIN IMMEDIATE')
+
+
+class WriteQueue:
+    # Small write transactions are handed to a single writer thread, which
+    # runs everything queued in one transaction, so one lock acquisition and
+    # one WAL sync cover the whole group.
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['SQLITE_PRODUCTION']
+        self.batch_size = app.config['SQLITE_GROUP_COMMIT_SIZE']
+        self.retries = app.config['SQLITE_BUSY_RETRIES']
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def run(self, job):
+        if not self.enabled:
+            def transaction():
+                result = job()
+                db.session.commit()
+                return result
+            return retry_on_busy(transaction, self.retries)
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name='sqlite-writer', daemon=True)
+                    self._thread.start()
+        future = Future()
+        self._queue.put((job, future))
+        result = future.result()
+        # The writer thread has no request, so the session hooks could not
+        # do this, and anything this request loaded may now be stale.
+        mark_written()
+        db.session.expire_all()
+        return result
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._commit(batch)
+                except Exception:
+                    self.app.logger.exception('Group commit failed')
+                finally:
+                    db.session.remove()
+
+    def _transaction(self, batch):
+        db.session.connection(execution_options={'sqlite_immediate': True})
+        results = []
+        for i, (job, future) in enumerate(batch):
+            try:
+                results.append(job())
+                db.session.flush()
+            except Exception as e:
+                if is_busy(e):
+                    raise
+                db.session.rollback()
+                return i, e
+        db.session.commit()
+        return None, results
+
+    def _commit(self, batch):
+        # A failing job takes the rest of the group down with it, so the group
+        # is run again without it. Savepoints would avoid that, but session
+        # hooks treat every released savepoint as a commit.
+        while batch:
+            try:
+                failed, outcome = retry_on_busy(
+                    lambda: self._transaction(batch), self.retries)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                raise
+            if failed is None:
+                for (_, future), result in zip(batch, outcome):
+                    future.set_result(result)
+                return
+            batch[failed][1].set_exception(outcome)
+            del batch[failed]
+
+
+def init_app(app):
+    if not app.config['SQLITE_PRODUCTION']:
+        return
+    with app.app_context():
+        engines = [engine for engine in db.engines.values()
+                   if engine.dialect.name == 'sqlite']
+    connect = _connect(app)
+    for engine in engines:
+        sa.event.listen(engine, 'connect', connect)
+        sa.event.listen(engine, 'begin', _begin)
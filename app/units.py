@@ -0,0 +1,145 @@
+from collections import namedtuple
+from fractions import Fraction
+import math
+import re
+
+MASS, VOLUME, COUNT = 'mass', 'volume', 'count'
+
+Unit = namedtuple('Unit', ['dimension', 'factor'])
+ScaledIngredient = namedtuple('ScaledIngredient',
+                              ['quantity', 'unit', 'description'])
+
+# Factors convert to grams, millilitres or items.
+UNITS = {
+    'mg': Unit(MASS, 0.001),
+    'g': Unit(MASS, 1),
+    'kg': Unit(MASS, 1000),
+    'oz': Unit(MASS, 28.349523125),
+    'lb': Unit(MASS, 453.59237),
+    'ml': Unit(VOLUME, 1),
+    'cl': Unit(VOLUME, 10),
+    'dl': Unit(VOLUME, 100),
+    'l': Unit(VOLUME, 1000),
+    'pinch': Unit(VOLUME, 0.3080576),
+    'tsp': Unit(VOLUME, 4.92892159375),
+    'tbsp': Unit(VOLUME, 14.78676478125),
+    'fl oz': Unit(VOLUME, 29.5735295625),
+    'cup': Unit(VOLUME, 236.5882365),
+    'pint': Unit(VOLUME, 473.176473),
+    'quart': Unit(VOLUME, 946.352946),
+    'gallon': Unit(VOLUME, 3785.411784),
+    '': Unit(COUNT, 1),
+    'dozen': Unit(COUNT, 12),
+}
+
+ALIASES = {
+    'milligram': 'mg', 'milligrams': 'mg',
+    'gram': 'g', 'grams': 'g', 'gr': 'g', 'grm': 'g',
+    'kilogram': 'kg', 'kilograms': 'kg', 'kilo': 'kg', 'kilos': 'kg',
+    'kgs': 'kg',
+    'ounce': 'oz', 'ounces': 'oz',
+    'pound': 'lb', 'pounds': 'lb', 'lbs': 'lb',
+    'millilitre': 'ml', 'millilitres': 'ml', 'milliliter': 'ml',
+    'milliliters': 'ml', 'mls': 'ml',
+    'centilitre': 'cl', 'centilitres': 'cl', 'centiliter': 'cl',
+    'centiliters': 'cl',
+    'decilitre': 'dl', 'decilitres': 'dl', 'deciliter': 'dl',
+    'deciliters': 'dl',
+    'litre': 'l', 'litres': 'l', 'liter': 'l', 'liters': 'l', 'ltr': 'l',
+    'pinches': 'pinch',
+    'teaspoon': 'tsp', 'teaspoons': 'tsp', 'tsps': 'tsp',
+    'tablespoon': 'tbsp', 'tablespoons': 'tbsp', 'tbsps': 'tbsp',
+    'tbs': 'tbsp', 'tbl': 'tbsp',
+    'fluid ounce': 'fl oz', 'fluid ounces': 'fl oz', 'floz': 'fl oz',
+    'cups': 'cup', 'c': 'cup',
+    'pints': 'pint', 'pt': 'pint',
+    'quarts': 'quart', 'qt': 'quart',
+    'gallons': 'gallon', 'gal': 'gallon',
+    'each': '', 'ea': '', 'piece': '', 'pieces': '', 'whole': '',
+    'dozens': 'dozen', 'doz': 'dozen',
+}
+
+METRIC = {MASS: [('g', 1), ('kg', 1000)],
+          VOLUME: [('ml', 1), ('l', 1000)],
+          COUNT: [('', 1)]}
+
+
+def normalize_unit(unit):
+    if unit is None:
+        return None
+    key = ' '.join(unit.lower().replace('.', ' ').split())
+    if key in UNITS:
+        return key
+    return ALIASES.get(key, unit.strip())
+
+
+QUANTITY = re.compile(r'\s*(\d+\s+\d+/\d+|\d+/\d+|\d+(?:\.\d+)?)\s*')
+
+
+def parse_ingredient(line):
+    # "1 1/2 cups plain flour" -> (1.5, 'cup', 'plain flour'). The unit is
+    # only taken from the words after the quantity when it is one we know.
+    quantity = None
+    match = QUANTITY.match(line)
+    if match:
+        try:
+            quantity = float(sum(Fraction(part)
+                                 for part in match.group(1).split()))
+        except ZeroDivisionError:
+            raise ValueError('Invalid quantity: {}'.format(match.group(1)))
+        line = line[match.end():]
+    words = line.split()
+    for size in (2, 1):
+        key = ' '.join(' '.join(words[:size]).lower().replace('.', ' ').split())
+        if len(words) > size and (key in UNITS or key in ALIASES):
+            return quantity, normalize_unit(key), ' '.join(words[size:])
+    return quantity, '', ' '.join(words)
+
+
+def format_ingredient(quantity, unit, description):
+    if quantity is not None and math.isfinite(quantity) and \
+            quantity == int(quantity):
+        quantity = int(quantity)
+    return ' '.join(str(part) for part in (quantity, unit, description)
+                    if part not in (None, ''))
+
+
+def convert(quantities, units, factor=1, metric=False):
+    # Works on whole columns at once so a recipe is one pass over two lists.
+    known = [UNITS.get(unit) for unit in units]
+    scaled = [None if quantity is None else quantity * factor
+              for quantity in quantities]
+    if not metric:
+        return scaled, list(units)
+    base = [quantity if unit is None or quantity is None
+            else quantity * unit.factor
+            for quantity, unit in zip(scaled, known)]
+    out_units = []
+    out_quantities = []
+    for quantity, unit, original in zip(base, known, units):
+        if unit is None or quantity is None:
+            out_quantities.append(quantity)
+            out_units.append(original)
+            continue
+        name, size = METRIC[unit.dimension][0]
+        for candidate, candidate_size in METRIC[unit.dimension]:
+            if abs(quantity) >= candidate_size:
+                name, size = candidate, candidate_size
+        out_quantities.append(quantity / size)
+        out_units.append(name)
+    return out_quantities, out_units
+
+
+def round_quantity(quantity):
+    if quantity is None:
+        return None
+    if abs(quantity) >= 100:
+        return float(round(quantity))
+    return float(round(quantity, 1 if abs(quantity) >= 10 else 2))
+
+
+def scale_ingredients(ingredients, factor=1, metric=False):
+    quantities, units = convert([i.quantity for i in ingredients],
+                                [i.unit for i in ingredients], factor, metric)
+    return [ScaledIngredient(round_quantity(quantity), unit, i.description)
+            for quantity, unit, i in zip(quantities, units, ingredients)]
@@ -0,0 +1,30 @@
+import sqlalchemy as sa
+from app import db
+
+
+def compile_templates(app):
+    names = app.jinja_env.list_templates()
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def prime_pools(app):
+    with app.app_context():
+        for engine in db.engines.values():
+            size = engine.pool.size() if isinstance(engine.pool, sa.QueuePool) \
+                else 1
+            connections = [engine.connect() for _ in range(size)]
+            for connection in connections:
+                connection.close()
+    if app.elasticsearch:
+        app.elasticsearch.options(
+            request_timeout=app.config['ELASTICSEARCH_SEARCH_TIMEOUT']).ping()
+
+
+def warm_up(app):
+    # Pays for the work a worker would otherwise do on its first requests:
+    # compiling templates and opening database and search connections.
+    # Connections must not cross a fork, so it runs in each worker.
+    compile_templates(app)
+    prime_pools(app)
@@ -8,9 +8,63 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'you-will-never-guess'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
+    DATABASE_REPLICA_URLS = [url for url in
+                             os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                             if url]
+    SQLALCHEMY_BINDS = {'replica{}'.format(i): url
+                        for i, url in enumerate(DATABASE_REPLICA_URLS)}
+    REPLICA_LAG_WINDOW = int(os.environ.get('REPLICA_LAG_WINDOW') or 10)
+    SQLITE_PRODUCTION = os.environ.get('SQLITE_PRODUCTION') == '1'
+    SQLITE_BUSY_TIMEOUT = 5
+    SQLITE_BUSY_RETRIES = 5
+    SQLITE_CACHE_SIZE = 64 * 1024
+    SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+    SQLITE_GROUP_COMMIT_SIZE = 100
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    ELASTICSEARCH_SEARCH_TIMEOUT = float(
+        os.environ.get('ELASTICSEARCH_SEARCH_TIMEOUT') or 2)
+    ELASTICSEARCH_WRITE_TIMEOUT = float(
+        os.environ.get('ELASTICSEARCH_WRITE_TIMEOUT') or 10)
+    ELASTICSEARCH_POOL_SIZE = int(os.environ.get('ELASTICSEARCH_POOL_SIZE')
+                                  or 10)
+    ELASTICSEARCH_MAX_RETRIES = int(os.environ.get('ELASTICSEARCH_MAX_RETRIES')
+                                    or 0)
+    SEARCH_BREAKER_THRESHOLD = 5
+    SEARCH_BREAKER_RESET = 30
+    SEARCH_INDEX_PATH = os.environ.get(
+        'SEARCH_INDEX_PATH', os.path.join(basedir, 'instance', 'search.db'))
+    SEARCH_MAX_RESULTS = int(os.environ.get('SEARCH_MAX_RESULTS') or 1000)
+    SEARCH_INDEXER_THREAD = os.environ.get('SEARCH_INDEXER_THREAD', '1') == '1'
+    SEARCH_INDEXER_BATCH_SIZE = 500
+    SEARCH_INDEXER_INTERVAL = 5
+    SEARCH_INDEXER_MAX_BACKOFF = 300
     RECIPES_PER_PAGE = 5
+    FRAGMENT_CACHE_SIZE = 10000
+    FRAGMENT_CACHE_PATH = os.environ.get('FRAGMENT_CACHE_PATH')
+    SEARCH_CACHE_SIZE = 1000
+    SEARCH_CACHE_TTL = 60
+    LAST_SEEN_GRANULARITY = 60
+    LAST_SEEN_FLUSH_INTERVAL = 30
+    QUERY_BUDGET_ENFORCE = os.environ.get('QUERY_BUDGET_ENFORCE') == '1'
+    SLOW_REQUEST_THRESHOLD = float(os.environ.get('SLOW_REQUEST_THRESHOLD')
+                                   or 0)
+    PANTRY_RESULTS = 20
+    PANTRY_INDEX_MAX_AGE = 300
+    MEAL_PLAN_SIZE = 500
+    INGREDIENTS_PER_RECIPE = 200
+    API_BATCH_SIZE = 100
+    API_COMPRESS_MIN_SIZE = 1024
+    API_GZIP_LEVEL = 6
+    API_BROTLI_QUALITY = 4
+    TEMPLATE_CACHE_PATH = os.environ.get(
+        'TEMPLATE_CACHE_PATH', os.path.join(basedir, 'instance', 'templates'))
+    WARM_UP = os.environ.get('WARM_UP') == '1'
+    SIMILAR_RESULTS = 5
+    SIMILAR_INDEX_MAX_AGE = 3600
+    AUTOCOMPLETE_RESULTS = 10
+    AUTOCOMPLETE_MAX_TERMS = 100000
     LANGUAGES = ['en']
     MAX_CONTENT_LENGTH = 1024 * 1024
     UPLOAD_EXTENSIONS = ['.jpg', '.png', '.gif', '.webp']
     UPLOAD_PATH = 'app/static/images'
+    IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS') or 2)
@@ -0,0 +1,56 @@
+import os
+import pytest
+from config import Config
+from app import create_app, db
+from app.models import User
+
+
+@pytest.fixture
+def app(tmp_path):
+    class TestConfig(Config):
+        TESTING = True
+        WTF_CSRF_ENABLED = False
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + str(tmp_path / 'app.db')
+        SQLALCHEMY_BINDS = {}
+        DATABASE_REPLICA_URLS = []
+        SQLITE_PRODUCTION = False
+        ELASTICSEARCH_URL = None
+        SEARCH_INDEX_PATH = str(tmp_path / 'search.db')
+        SEARCH_INDEXER_THREAD = False
+        FRAGMENT_CACHE_PATH = None
+        TEMPLATE_CACHE_PATH = ''
+        UPLOAD_PATH = str(tmp_path / 'images')
+        WARM_UP = False
+        QUERY_BUDGET_ENFORCE = True
+
+    os.makedirs(TestConfig.UPLOAD_PATH)
+    app = create_app(TestConfig)
+    with app.app_context():
+        db.create_all(bind_key=None)
+    # Requests push their own app context, so g (and the logged in user
+    # Flask-Login keeps there) is not shared between clients.
+    yield app
+    with app.app_context():
+        db.engine.dispose()
+
+
+def add_user(app, username):
+    with app.app_context():
+        user = User(username=username, email=username + '@example.com')
+        user.set_password('password')
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+
+
+def login(app, username):
+    client = app.test_client()
+    client.post('/auth/login', data={'username': username,
+                                     'password': 'password'})
+    return client
+
+
+@pytest.fixture
+def client(app):
+    add_user(app, 'alice')
+    return login(app, 'alice')
@@ -0,0 +1,92 @@
+import gzip
+from datetime import datetime, timedelta
+import orjson
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.models import Ingredient, Recipe, User
+
+
+@pytest.fixture
+def recipes(app, client):
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        recipes = [Recipe(title='Recipe {}'.format(i), method='Cook it',
+                          creator=user, timestamp=start + timedelta(hours=i))
+                   for i in range(5)]
+        db.session.add_all(recipes)
+        db.session.flush()
+        db.session.add(Ingredient(description='rice', quantity=2, unit='cup',
+                                  recipe_id=recipes[0].id))
+        db.session.commit()
+        return [recipe.id for recipe in recipes]
+
+
+def test_login_is_required(app, recipes):
+    response = app.test_client().get('/api/v1/recipes/{}'.format(recipes[0]))
+    assert response.status_code == 401
+    assert response.json == {'error': 'Unauthorized'}
+
+
+def test_fields_are_projected(client, recipes):
+    response = client.get('/api/v1/recipes/{}?fields=title,ingredients,creator'
+                          .format(recipes[0]))
+    assert response.json == {
+        'id': recipes[0], 'title': 'Recipe 0',
+        'creator': {'username': 'alice'},
+        'ingredients': [{'id': 1, 'description': 'rice', 'quantity': 2.0,
+                         'unit': 'cup'}]}
+    response = client.get('/api/v1/recipes/{}?fields=title,secret'
+                          .format(recipes[0]))
+    assert response.status_code == 400
+    assert response.json['message'] == 'Unknown fields: secret'
+
+
+def test_batch_fetch_keeps_order_and_reports_missing(client, recipes):
+    response = client.get('/api/v1/recipes?fields=title&ids={},999,{}'.format(
+        recipes[2], recipes[0]))
+    assert response.json == {
+        'items': [{'id': recipes[2], 'title': 'Recipe 2'},
+                  {'id': recipes[0], 'title': 'Recipe 0'}],
+        'missing': [999]}
+    assert client.get('/api/v1/recipes?ids=1,x').status_code == 400
+
+
+def test_cursors_page_through_the_feed(client, recipes):
+    first = client.get('/api/v1/recipes?fields=title&limit=2').json
+    assert [item['title'] for item in first['items']] == \
+        ['Recipe 4', 'Recipe 3']
+    assert first['prev_cursor'] is None
+    second = client.get(first['_links']['next']).json
+    assert [item['title'] for item in second['items']] == \
+        ['Recipe 2', 'Recipe 1']
+    last = client.get(second['_links']['next']).json
+    assert [item['title'] for item in last['items']] == ['Recipe 0']
+    assert last['_links']['next'] is None
+    back = client.get(last['_links']['prev']).json
+    assert back['items'] == second['items']
+    assert client.get('/api/v1/recipes?limit=0').status_code == 400
+
+
+def test_large_responses_are_compressed(app, client, recipes):
+    app.config['API_COMPRESS_MIN_SIZE'] = 100
+    url = '/api/v1/recipes?limit=5'
+    plain = client.get(url)
+    assert 'Content-Encoding' not in plain.headers
+    assert 'Accept-Encoding' in plain.headers['Vary']
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert orjson.loads(gzip.decompress(response.data)) == plain.json
+    small = client.get('/api/v1/recipes/{}?fields=title'.format(recipes[0]),
+                       headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in small.headers
+
+
+def test_brotli_is_preferred(app, client, recipes):
+    brotli = pytest.importorskip('brotli')
+    app.config['API_COMPRESS_MIN_SIZE'] = 100
+    response = client.get('/api/v1/recipes?limit=5',
+                          headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
+    assert orjson.loads(brotli.decompress(response.data))['items']
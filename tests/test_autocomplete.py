@@ -0,0 +1,57 @@
+import sqlalchemy as sa
+from app import db
+from app.autocomplete import PrefixIndex
+from app.models import Ingredient, Recipe, User
+
+
+def index(results=2):
+    index = PrefixIndex(max_terms=10, max_length=64, results=results)
+    index.load({'garlic': 5, 'ginger': 3, 'gin': 1, 'green beans': 2},
+               {'garlic': 'Garlic', 'ginger': 'Ginger', 'gin': 'Gin',
+                'green beans': 'Green beans'})
+    return index
+
+
+def test_complete_ranks_by_weight():
+    assert index().complete('G', 2) == ['Garlic', 'Ginger']
+    assert index().complete('gin', 5) == ['Ginger', 'Gin']
+    assert index().complete('  Green   b', 5) == ['Green beans']
+    assert index().complete('x', 5) == []
+    assert index().complete('', 5) == []
+
+
+def test_add_updates_the_top_completions():
+    prefixes = index()
+    prefixes.add('Gin', 4)
+    assert prefixes.complete('g', 2) == ['Garlic', 'Gin']
+    prefixes.add('Gnocchi', 9)
+    assert prefixes.complete('g', 2) == ['Gnocchi', 'Garlic']
+    assert prefixes.complete('gn', 2) == ['Gnocchi']
+
+
+def test_removing_a_top_key_promotes_the_next_one():
+    prefixes = index()
+    prefixes.add('garlic', -5)
+    assert prefixes.complete('g', 2) == ['Ginger', 'Green beans']
+    assert prefixes.complete('ga', 2) == []
+    prefixes.add('ginger', -1)
+    assert prefixes.complete('gi', 2) == ['Ginger', 'Gin']
+
+
+def test_limit_is_clamped(app, client):
+    with app.app_context():
+        recipe = Recipe(title='Soup', creator=db.session.scalar(sa.select(User)))
+        db.session.add(recipe)
+        db.session.flush()
+        for description in ('garlic', 'garlic', 'garlic', 'ginger', 'ginger',
+                            'gin'):
+            db.session.add(Ingredient(description=description,
+                                      recipe_id=recipe.id))
+        db.session.commit()
+
+    def complete(q, limit):
+        return client.get('/autocomplete?kind=ingredient&q={}&limit={}'.format(
+            q, limit)).json['suggestions']
+    assert complete('g', 0) == ['garlic', 'ginger', 'gin']
+    assert complete('g', -1) == ['garlic']
+    assert complete('gin', -1) == ['ginger']
@@ -0,0 +1,60 @@
+import threading
+import time
+import pytest
+from app.fakes import FakeElasticsearch
+from app.search import CircuitBreaker, ElasticsearchBackend, SearchUnavailable
+
+
+@pytest.fixture
+def server():
+    server = FakeElasticsearch()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def backend(server):
+    from elasticsearch import Elasticsearch
+    client = Elasticsearch([server.url], max_retries=0,
+                           retry_on_timeout=False)
+    breaker = CircuitBreaker('fake elasticsearch', threshold=2,
+                             reset_timeout=60)
+    return ElasticsearchBackend(client, 0.2, 0.2, breaker)
+
+
+def test_search(backend):
+    assert backend.search('recipe', 'curry', 1, 5) == ([], 0)
+    assert backend.breaker.state == 'closed'
+
+
+def test_failing_server_opens_the_circuit(server, backend):
+    server.status = 503
+    for _ in range(2):
+        with pytest.raises(SearchUnavailable) as e:
+            backend.search('recipe', 'curry', 1, 5)
+        assert e.value.__cause__ is not None
+    assert backend.breaker.state == 'open'
+    server.status = 200
+    with pytest.raises(SearchUnavailable) as e:
+        backend.search('recipe', 'curry', 1, 5)
+    assert e.value.__cause__ is None
+    assert e.value.retry_after > 0
+
+
+def test_slow_server_times_out(server, backend):
+    server.delay = 1
+    start = time.perf_counter()
+    with pytest.raises(SearchUnavailable):
+        backend.search('recipe', 'curry', 1, 5)
+    assert time.perf_counter() - start < 0.9
+    assert backend.breaker.failures == 1
+
+
+def test_client_errors_are_not_outages(server, backend):
+    from elasticsearch import ApiError
+    server.status = 400
+    with pytest.raises(ApiError):
+        backend.search('recipe', 'curry', 1, 5)
+    assert backend.breaker.failures == 0
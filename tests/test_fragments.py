@@ -0,0 +1,30 @@
+from app import db
+from app.models import Recipe, User
+from conftest import add_user
+
+
+def cached(app, id):
+    return app.fragment_cache.get(('recipe_row', id, None)) is not None
+
+
+def test_renaming_a_user_only_invalidates_their_recipes(app):
+    alice = add_user(app, 'alice')
+    bob = add_user(app, 'bob')
+    with app.app_context():
+        recipes = [Recipe(title='Soup', user_id=alice),
+                   Recipe(title='Stew', user_id=bob)]
+        db.session.add_all(recipes)
+        db.session.commit()
+        soup, stew = (recipe.id for recipe in recipes)
+        for id in (soup, stew):
+            app.fragment_cache.set(('recipe_row', id, None), (None, 'html'))
+
+        user = db.session.get(User, alice)
+        user.about_me = 'Cooks soup'
+        db.session.commit()
+        assert cached(app, soup) and cached(app, stew)
+
+        user.username = 'alicia'
+        db.session.commit()
+        assert not cached(app, soup)
+        assert cached(app, stew)
@@ -0,0 +1,110 @@
+import io
+import os
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from app.images import InvalidImage
+
+
+def upload(data, filename='photo.png'):
+    return FileStorage(io.BytesIO(data), filename=filename)
+
+
+def png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 8), 'red').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+class FakeExecutor:
+    def __init__(self, error=None, broken=False):
+        self.error = error
+        self.broken = broken
+        self.submitted = 0
+
+    def submit(self, f, *args):
+        if self.broken:
+            raise BrokenProcessPool()
+        self.submitted += 1
+        future = Future()
+        if self.error:
+            future.set_exception(self.error)
+        else:
+            future.set_result(None)
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+@pytest.mark.parametrize('data, filename', [
+    (b'not an image', 'photo.png'),
+    (png()[:40], 'photo.png'),
+    (png(), 'photo.jpg'),
+])
+def test_invalid_uploads_are_not_stored(app, data, filename):
+    store = app.images
+    store._executor = FakeExecutor()
+    with pytest.raises(InvalidImage):
+        store.save(upload(data, filename), os.path.splitext(filename)[1])
+    assert os.listdir(store.root) == []
+    assert store._executor.submitted == 0
+
+
+def test_failed_images_are_not_resubmitted(app):
+    store = app.images
+    store._executor = executor = FakeExecutor(error=OSError('bad'))
+    image = store.save(upload(png()), '.png')
+    assert executor.submitted == 1
+    assert store.locate(image, 'thumb.webp')[2] is False
+    assert executor.submitted == 1
+
+
+def test_broken_pool_is_replaced(app, monkeypatch):
+    store = app.images
+    replacement = FakeExecutor()
+    monkeypatch.setattr('app.images.ProcessPoolExecutor',
+                        lambda *args, **kwargs: replacement)
+    store._executor = FakeExecutor(broken=True)
+    store.save(upload(png()), '.png')
+    assert replacement.submitted == 1
+    assert store._executor is replacement
+
+
+def test_worker_crash_is_retried(app, monkeypatch):
+    store = app.images
+    replacement = FakeExecutor()
+    monkeypatch.setattr('app.images.ProcessPoolExecutor',
+                        lambda *args, **kwargs: replacement)
+    store._executor = crashed = FakeExecutor(error=BrokenProcessPool())
+    image = store.save(upload(png()), '.png')
+    assert store._executor is None
+    store.locate(image, 'thumb.webp')
+    assert crashed.submitted == 1 and replacement.submitted == 1
+
+
+@pytest.mark.parametrize('name', ['bogus.webp', 'thumb.jpg', 'original.png'])
+def test_unknown_variants_are_not_found(app, name):
+    store = app.images
+    store._executor = executor = FakeExecutor()
+    image = store.save(upload(png()), '.png')
+    assert store.locate(image, name) is None
+    assert executor.submitted == 1
+    client = app.test_client()
+    assert client.get('/images/{}/{}'.format(image, name)).status_code == 404
+    assert executor.submitted == 1
+
+
+def test_missing_variant_is_queued_once(app):
+    store = app.images
+    store._executor = executor = FakeExecutor()
+    image = store.save(upload(png()), '.png')
+    store._pending.add(image[:-4])
+    for _ in range(3):
+        assert store.locate(image, 'thumb.webp')[1] == 'original.png'
+    assert executor.submitted == 1
+    store._pending.clear()
+    store.locate(image, 'thumb.webp')
+    assert executor.submitted == 2
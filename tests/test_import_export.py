@@ -0,0 +1,53 @@
+import json
+import pytest
+from conftest import add_user
+
+RECIPES = [
+    {'title': 'Pancakes', 'method': 'Whisk and fry', 'author': 'alice',
+     'timestamp': '2024-01-01T08:00:00',
+     'ingredients': [
+         {'description': 'flour', 'quantity': 200.0, 'unit': 'g'},
+         {'description': 'milk', 'quantity': 0.5, 'unit': 'l'},
+         {'description': 'salt', 'quantity': None, 'unit': None}]},
+    {'title': 'Toast', 'method': None, 'author': 'bob',
+     'timestamp': '2024-01-02T08:00:00', 'ingredients': []},
+]
+
+
+def export(app, tmp_path, name):
+    path = tmp_path / name
+    result = app.test_cli_runner().invoke(args=['recipes', 'export', str(path)])
+    assert result.exit_code == 0, result.output
+    return path
+
+
+@pytest.mark.parametrize('name', ['recipes.jsonl', 'recipes.csv'])
+def test_round_trip(app, tmp_path, name):
+    add_user(app, 'alice')
+    add_user(app, 'bob')
+    source = tmp_path / 'source.jsonl'
+    source.write_text(''.join(json.dumps(r) + '\n' for r in RECIPES))
+    runner = app.test_cli_runner()
+    result = runner.invoke(args=['recipes', 'import', str(source),
+                                 '--batch-size', '1'])
+    assert result.exit_code == 0, result.output
+    assert '2 recipes, 3 ingredients' in result.output
+
+    exported = export(app, tmp_path, name)
+    # Importing the export again gives an identical export.
+    result = runner.invoke(args=['recipes', 'import', str(exported)])
+    assert result.exit_code == 0, result.output
+    records = [json.loads(line) for line in
+               export(app, tmp_path, 'all.jsonl').read_text().splitlines()]
+    for record in records:
+        record.pop('recipe')
+    assert records == RECIPES + RECIPES
+
+
+def test_unknown_author_is_rejected(app, tmp_path):
+    source = tmp_path / 'source.jsonl'
+    source.write_text(json.dumps(RECIPES[1]) + '\n')
+    result = app.test_cli_runner().invoke(
+        args=['recipes', 'import', str(source)])
+    assert result.exit_code != 0
+    assert 'Unknown authors: bob' in result.output
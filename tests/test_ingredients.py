@@ -0,0 +1,137 @@
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.instrumentation import count_queries
+from app.models import Ingredient, Recipe, User
+from conftest import add_user, login
+
+
+@pytest.fixture
+def recipe(app, client):
+    with app.app_context():
+        user = db.session.scalar(sa.select(User).where(User.username == 'alice'))
+        recipe = Recipe(title='Pancakes', creator=user)
+        db.session.add(recipe)
+        db.session.commit()
+        return recipe.id
+
+
+def batch_url(recipe):
+    return '/recipe_ingredients/{}/batch'.format(recipe)
+
+
+def ingredients(app, recipe):
+    with app.app_context():
+        return db.session.execute(
+            sa.select(Ingredient.quantity, Ingredient.unit,
+                      Ingredient.description)
+            .where(Ingredient.recipe_id == recipe)
+            .order_by(Ingredient.id)).all()
+
+
+def ingredient_id(app, description):
+    with app.app_context():
+        return db.session.scalar(sa.select(Ingredient.id).where(
+            Ingredient.description == description))
+
+
+def version(app, recipe):
+    with app.app_context():
+        return db.session.get(Recipe, recipe).version
+
+
+def test_pasted_list_is_applied_as_a_diff(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': '2 cups flour\n2 sprig thyme'})
+    flour = ingredient_id(app, 'flour')
+    client.post(batch_url(recipe), data={'ingredients': '3 cups flour\n2 eggs'})
+    assert ingredients(app, recipe) == [(3.0, 'cup', 'flour'), (2.0, '', 'eggs')]
+    assert ingredient_id(app, 'flour') == flour
+
+
+def test_unchanged_list_changes_nothing(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': '2 sprig thyme'})
+    before = version(app, recipe)
+    response = client.post(batch_url(recipe), data={'ingredients': '2 sprig thyme'})
+    assert response.status_code == 302
+    assert version(app, recipe) == before
+
+
+def test_json_list(app, client, recipe):
+    response = client.post(batch_url(recipe), json=[
+        {'description': 'milk', 'quantity': 300, 'unit': 'millilitres'}])
+    assert response.json == {'added': 1, 'updated': 0, 'deleted': 0}
+    response = client.post(batch_url(recipe), json={'ingredients': [
+        {'id': ingredient_id(app, 'milk'), 'description': 'oat milk',
+         'quantity': 250, 'unit': 'ml'}]})
+    assert response.json == {'added': 0, 'updated': 1, 'deleted': 0}
+    assert ingredients(app, recipe) == [(250.0, 'ml', 'oat milk')]
+
+
+@pytest.mark.parametrize('body', [
+    [{'id': 999, 'description': 'x'}],
+    [{'description': ''}],
+    [{'description': 'x', 'quantity': True}],
+    {'ingredients': 'flour'},
+])
+def test_invalid_json_list(app, client, recipe, body):
+    response = client.post(batch_url(recipe), json=body)
+    assert response.status_code == 400
+    assert ingredients(app, recipe) == []
+
+
+@pytest.mark.parametrize('quantity', ['Infinity', '-Infinity', 'NaN'])
+def test_non_finite_quantity(app, client, recipe, quantity):
+    response = client.post(
+        batch_url(recipe),
+        data='[{"description": "flour", "quantity": %s}]' % quantity,
+        content_type='application/json')
+    assert response.status_code == 400
+    assert response.json == {'error': 'Invalid ingredient quantity'}
+
+
+def test_zero_denominator(app, client, recipe):
+    response = client.post(batch_url(recipe),
+                           data={'ingredients': '1/0 cup flour'})
+    assert response.status_code == 302
+    assert ingredients(app, recipe) == []
+
+
+def test_only_the_creator_can_edit_the_list(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': 'flour'})
+    add_user(app, 'bob')
+    bob = login(app, 'bob')
+    assert bob.post(batch_url(recipe), data={'ingredients': ''}).status_code == 403
+    assert bob.post(batch_url(recipe), json=[]).status_code == 403
+    assert ingredients(app, recipe) == [(None, '', 'flour')]
+
+
+def test_cached_page_loads_the_list_only_for_the_editor(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': '2 cups flour'})
+    url = '/recipe_ingredients/{}'.format(recipe)
+    client.get(url)
+    with count_queries() as counter:
+        response = client.get(url)
+    assert b'2 cup flour' in response.data
+    assert not any('FROM ingredient' in statement
+                   for statement in counter.statements)
+    assert b'2 cup flour</textarea>' not in response.data
+    response = client.get(url + '?edit=1')
+    assert b'2 cup flour</textarea>' in response.data
+
+
+def test_delete_ingredient(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': 'flour\neggs'})
+    flour = ingredient_id(app, 'flour')
+    response = client.get('/delete_ingredient/{}'.format(flour))
+    assert response.status_code == 302
+    assert ingredients(app, recipe) == [(None, '', 'eggs')]
+    assert client.get('/delete_ingredient/{}'.format(flour)).status_code == 404
+
+
+def test_only_the_creator_can_delete_an_ingredient(app, client, recipe):
+    client.post(batch_url(recipe), data={'ingredients': 'flour'})
+    flour = ingredient_id(app, 'flour')
+    add_user(app, 'bob')
+    bob = login(app, 'bob')
+    assert bob.get('/delete_ingredient/{}'.format(flour)).status_code == 403
+    assert ingredients(app, recipe) == [(None, '', 'flour')]
@@ -0,0 +1,52 @@
+import gc
+import weakref
+from datetime import datetime, timedelta, timezone
+import sqlalchemy as sa
+from app import create_app, db
+from app.instrumentation import count_queries
+from app.last_seen import _buffers
+from app.models import User
+from conftest import add_user
+
+
+def stored(app, id):
+    with app.app_context():
+        return db.session.scalar(sa.select(User.last_seen).where(User.id == id))
+
+
+def test_record_coalesces_and_flush_writes_once(app):
+    ids = [add_user(app, name) for name in ('alice', 'bob')]
+    yesterday = datetime(2024, 1, 1)
+    buffer = app.last_seen
+    buffer.flush_interval = 3600
+    with app.app_context():
+        db.session.execute(sa.update(User).values(last_seen=yesterday))
+        db.session.commit()
+        users = db.session.scalars(sa.select(User)).all()
+        for user in users:
+            buffer.record(user)
+        seen = buffer.get(users[0])
+        # A second visit within the granularity changes nothing.
+        buffer.record(users[0])
+        assert buffer.get(users[0]) == seen
+        assert stored(app, ids[0]) == yesterday
+        with count_queries() as counter:
+            buffer.flush()
+    assert counter.count == 1
+    assert buffer._pending == {}
+    for id in ids:
+        assert stored(app, id).replace(tzinfo=timezone.utc) - seen < \
+            timedelta(seconds=1)
+
+
+def test_discarded_apps_are_not_kept_for_exit(app):
+    class Copy:
+        pass
+    for key, value in app.config.items():
+        setattr(Copy, key, value)
+    other = create_app(Copy)
+    buffer = weakref.ref(other.last_seen)
+    assert buffer() in _buffers
+    del other
+    gc.collect()
+    assert buffer() is None
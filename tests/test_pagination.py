@@ -0,0 +1,46 @@
+from datetime import datetime, timedelta
+import sqlalchemy as sa
+from app import db
+from app.models import Recipe, User
+from app.pagination import decode_cursor, encode_cursor, keyset_paginate
+from conftest import add_user
+
+
+def test_cursor_round_trip():
+    timestamp = datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(timestamp, 42)) == (timestamp, 42)
+    assert decode_cursor('not a cursor') is None
+
+
+def test_keyset_pages_forwards_and_backwards(app):
+    user_id = add_user(app, 'alice')
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        # Pairs share a timestamp, so the id has to break the tie.
+        db.session.add_all(Recipe(title=str(i), user_id=user_id,
+                                  timestamp=start + timedelta(minutes=i // 2))
+                           for i in range(7))
+        db.session.commit()
+        query = sa.select(Recipe)
+
+        def titles(page):
+            return [recipe.title for recipe in page.items]
+
+        first = keyset_paginate(query, Recipe.timestamp, Recipe.id, 3)
+        assert titles(first) == ['6', '5', '4'] and not first.has_prev
+        second = keyset_paginate(query, Recipe.timestamp, Recipe.id, 3,
+                                 after=first.next_cursor)
+        assert titles(second) == ['3', '2', '1']
+        last = keyset_paginate(query, Recipe.timestamp, Recipe.id, 3,
+                               after=second.next_cursor)
+        assert titles(last) == ['0'] and not last.has_next
+        back = keyset_paginate(query, Recipe.timestamp, Recipe.id, 3,
+                               before=last.prev_cursor)
+        assert titles(back) == ['3', '2', '1']
+        assert back.has_next and back.has_prev
+
+        rows = keyset_paginate(Recipe.list_query(), Recipe.timestamp,
+                               Recipe.id, 3, factory=Recipe.from_row)
+        assert [(r.title, r.creator.username) for r in rows.items] == \
+            [('6', 'alice'), ('5', 'alice'), ('4', 'alice')]
+        assert db.session.scalar(sa.select(sa.func.count(User.id))) == 1
@@ -0,0 +1,55 @@
+import sqlalchemy as sa
+from app import db
+from app.models import Ingredient, Recipe, User
+from app.pantry import normalize, to_bitset
+from conftest import add_user
+
+
+def add_recipe(app, title, ingredients):
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        recipe = Recipe(title=title, creator=user)
+        db.session.add(recipe)
+        db.session.flush()
+        for description in ingredients:
+            db.session.add(Ingredient(description=description,
+                                      recipe_id=recipe.id))
+        db.session.commit()
+        return recipe.id
+
+
+def test_normalize():
+    assert normalize('Ripe Tomatoes') == 'ripe tomato'
+    assert normalize('Cherries') == 'cherry'
+    assert normalize('Grass') == 'grass'
+    assert normalize('2 eggs!') == 'egg'
+
+
+def test_to_bitset():
+    assert to_bitset([]) == 0
+    assert to_bitset([0, 3, 9]) == 0b1000001001
+
+
+def test_pantry_ranks_by_coverage(app):
+    add_user(app, 'alice')
+    omelette = add_recipe(app, 'Omelette', ['eggs', 'butter'])
+    cake = add_recipe(app, 'Cake', ['eggs', 'flour', 'sugar', 'butter'])
+    add_recipe(app, 'Salad', ['lettuce'])
+    with app.app_context():
+        matches = app.pantry_index.search(['egg', 'Butter', 'flour'])
+    assert matches == [(omelette, 1.0, []), (cake, 0.75, ['sugar'])]
+
+
+def test_pantry_refresh_follows_ingredient_changes(app):
+    add_user(app, 'alice')
+    with app.app_context():
+        assert app.pantry_index.search(['rice']) == []
+    risotto = add_recipe(app, 'Risotto', ['rice', 'stock'])
+    with app.app_context():
+        # The commit refreshed the loaded index without a rebuild.
+        assert app.pantry_index.search(['rice', 'stock']) == [(risotto, 1.0, [])]
+        db.session.execute(sa.delete(Ingredient).where(
+            Ingredient.description == 'stock'))
+        db.session.commit()
+        app.pantry_index.refresh([risotto])
+        assert app.pantry_index.search(['rice']) == [(risotto, 1.0, [])]
@@ -0,0 +1,58 @@
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.instrumentation import QueryBudgetExceeded, count_queries, \
+    query_budget
+from app.models import Ingredient, Recipe, User
+from conftest import add_user
+
+
+@pytest.fixture
+def recipes(app, client):
+    app.config['RECIPES_PER_PAGE'] = 20
+    add_user(app, 'bob')
+    with app.app_context():
+        users = db.session.scalars(sa.select(User)).all()
+        for i in range(30):
+            recipe = Recipe(title='Curry {}'.format(i), creator=users[i % 2])
+            db.session.add(recipe)
+            db.session.flush()
+            for description in ('rice', 'onion', 'curry paste'):
+                db.session.add(Ingredient(description=description, quantity=1,
+                                          unit='cup', recipe_id=recipe.id))
+        db.session.commit()
+        app.search_indexer.drain()
+        return db.session.scalars(sa.select(Recipe.id)).all()
+
+
+def test_routes_stay_within_their_query_budgets(app, client, recipes):
+    for id in recipes[:5]:
+        client.get('/meal_plan/add/{}'.format(id))
+    urls = ['/index', '/user/alice', '/user/bob', '/search?q=curry',
+            '/shopping_list', '/autocomplete?kind=ingredient&q=cu',
+            '/api/v1/recipes/{}'.format(recipes[0]),
+            '/api/v1/recipes?ids=' + ','.join(map(str, recipes[:20])),
+            '/api/v1/recipes?limit=20']
+    for url in urls:
+        # Over budget, _check_budget raises under TESTING.
+        assert client.get(url).status_code == 200, url
+
+
+def test_exceeding_the_budget_fails_the_request(app):
+    @query_budget(1)
+    def too_many_queries():
+        db.session.scalars(sa.select(Recipe)).all()
+        db.session.scalars(sa.select(Ingredient)).all()
+        return 'ok'
+    app.add_url_rule('/too-many-queries', view_func=too_many_queries)
+    with pytest.raises(QueryBudgetExceeded):
+        app.test_client().get('/too-many-queries')
+
+
+def test_count_queries(app):
+    with app.app_context():
+        with count_queries() as outer:
+            db.session.scalar(sa.select(sa.func.count(Recipe.id)))
+            with count_queries() as inner:
+                db.session.scalar(sa.select(sa.func.count(User.id)))
+    assert (outer.count, inner.count) == (2, 1)
@@ -0,0 +1,66 @@
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.models import Recipe, User
+from conftest import add_user, login
+
+
+@pytest.fixture
+def recipe(app, client):
+    with app.app_context():
+        alice = db.session.scalar(sa.select(User).where(
+            User.username == 'alice'))
+        recipe = Recipe(title='Soup', method='Simmer', creator=alice)
+        db.session.add(recipe)
+        db.session.commit()
+        return recipe.id
+
+
+@pytest.fixture
+def bob(app, client):
+    add_user(app, 'bob')
+    return login(app, 'bob')
+
+
+def etag(client, recipe):
+    response = client.get('/recipe/{}'.format(recipe))
+    assert response.status_code == 200
+    return response.headers.get('ETag')
+
+
+def test_unchanged_page_is_not_modified(bob, recipe):
+    tag = etag(bob, recipe)
+    response = bob.get('/recipe/{}'.format(recipe),
+                       headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == tag
+
+
+def test_owner_and_pending_flashes_get_no_etag(bob, client, recipe):
+    assert etag(client, recipe) is None
+    with bob.session_transaction() as session:
+        session['_flashes'] = [('message', 'Hello')]
+    assert etag(bob, recipe) is None
+
+
+def test_meal_plan_changes_the_etag(bob, recipe):
+    before = etag(bob, recipe)
+    bob.get('/meal_plan/add/{}'.format(recipe))
+    planned = etag(bob, recipe)
+    assert planned != before
+    bob.get('/meal_plan/remove/{}'.format(recipe))
+    assert etag(bob, recipe) == before
+
+
+def test_rename_and_edit_change_the_etag(app, bob, recipe):
+    before = etag(bob, recipe)
+    with app.app_context():
+        db.session.scalar(sa.select(User).where(User.username == 'bob')) \
+            .username = 'robert'
+        db.session.commit()
+    renamed = etag(bob, recipe)
+    assert renamed != before
+    with app.app_context():
+        db.session.get(Recipe, recipe).method = 'Boil'
+        db.session.commit()
+    assert etag(bob, recipe) != renamed
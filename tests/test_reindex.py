@@ -0,0 +1,52 @@
+import os
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.indexer import reindex
+from app.models import Recipe, User
+
+
+@pytest.fixture
+def recipes(app, client, tmp_path):
+    app.instance_path = str(tmp_path / 'instance')
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        db.session.add_all(Recipe(title='Curry {}'.format(i), creator=user)
+                           for i in range(10))
+        db.session.commit()
+        db.session.execute(sa.text('DELETE FROM search_outbox'))
+        db.session.commit()
+        return db.session.scalars(sa.select(Recipe.id).order_by(Recipe.id)).all()
+
+
+def test_fresh_reindex_resumes_from_its_checkpoint(app, recipes, monkeypatch):
+    backend = app.search_backend
+    bulk = backend.bulk
+    calls = []
+    failures = [OSError('connection lost')]
+
+    def failing_bulk(index, documents, deleted=()):
+        calls.append((index, [id for id, _ in documents]))
+        if len(calls) == 3 and failures:
+            raise failures.pop()
+        return bulk(index, documents, deleted)
+    monkeypatch.setattr(backend, 'bulk', failing_bulk)
+    checkpoint = os.path.join(app.instance_path, 'reindex-recipe.json')
+    with app.app_context():
+        with pytest.raises(OSError):
+            reindex(Recipe, chunk_size=2, workers=1, fresh=True)
+        assert os.path.exists(checkpoint)
+        building = calls[0][0]
+        assert building != 'recipe'
+        # The live index was not swapped to the half built one.
+        assert backend.search('recipe', 'curry', 1, 20) == ([], 0)
+
+        del calls[:]
+        reindex(Recipe, chunk_size=2, workers=1, resume=True)
+    assert not os.path.exists(checkpoint)
+    # Chunks already shipped are not sent again.
+    assert calls == [(building, recipes[4:6]), (building, recipes[6:8]),
+                     (building, recipes[8:10])]
+    hits, total = backend.search('recipe', 'curry', 1, 20)
+    assert total == 10
+    assert sorted(id for id, _ in hits) == recipes
@@ -0,0 +1,63 @@
+import shutil
+import sqlite3
+import pytest
+from app import create_app, db
+from conftest import add_user, login
+
+
+@pytest.fixture
+def replicated(app, tmp_path):
+    alice = add_user(app, 'alice')
+    with app.app_context():
+        db.engine.dispose()
+    primary = app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    replica = str(tmp_path / 'replica.db')
+    shutil.copy(primary, replica)
+    # The replica has a row the primary does not, so each page shows which
+    # database it was read from.
+    with sqlite3.connect(replica) as conn:
+        conn.execute("INSERT INTO recipe (id, title, user_id, timestamp) "
+                     "VALUES (1000, 'Only on the replica', ?, "
+                     "'2024-01-01 00:00:00')", (alice,))
+
+    class ReplicaConfig:
+        pass
+    for key, value in app.config.items():
+        setattr(ReplicaConfig, key, value)
+    ReplicaConfig.SQLALCHEMY_BINDS = {'replica0': 'sqlite:///' + replica}
+    app = create_app(ReplicaConfig)
+    yield app
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()
+
+
+def read_from_replica(client):
+    return b'Only on the replica' in client.get('/index').data
+
+
+def test_reads_go_to_the_replica_until_the_client_writes(replicated):
+    client = login(replicated, 'alice')
+    with client.session_transaction() as session:
+        session.pop('primary_until', None)
+    assert read_from_replica(client)
+
+    client.post('/index', data={'title': 'Lentil soup'})
+    with client.session_transaction() as session:
+        assert 'primary_until' in session
+    # The replica is behind, so the client's own recipe comes from the primary.
+    response = client.get('/index')
+    assert b'Lentil soup' in response.data
+    assert b'Only on the replica' not in response.data
+    # Other clients are not held to the primary by this one's write.
+    assert read_from_replica(login(replicated, 'alice'))
+
+    with client.session_transaction() as session:
+        session['primary_until'] = 0
+    assert read_from_replica(client)
+
+
+def test_views_not_marked_for_replicas_read_the_primary(replicated):
+    client = login(replicated, 'alice')
+    assert client.get('/recipe/1000').status_code == 200
+    assert client.get('/recipe_ingredients/1000').status_code == 404
@@ -0,0 +1,111 @@
+import sqlite3
+import time
+import pytest
+import sqlalchemy as sa
+from app import create_app, db
+from app.models import Recipe, User
+from conftest import add_user
+from app.search import CircuitBreaker, LocalSearchBackend, \
+    SearchSchemaChanged, SearchUnavailable
+
+
+def is_outage(e):
+    return isinstance(e, sqlite3.OperationalError)
+
+
+def fail():
+    raise sqlite3.OperationalError('disk I/O error')
+
+
+def test_breaker_opens_and_recovers_outside_app_context():
+    breaker = CircuitBreaker('test', threshold=2, reset_timeout=0.05)
+    for _ in range(2):
+        with pytest.raises(SearchUnavailable):
+            breaker.call(is_outage, fail)
+    assert breaker.state == 'open'
+    with pytest.raises(SearchUnavailable, match='circuit is open'):
+        breaker.call(is_outage, lambda: 'ok')
+    breaker.opened -= 1
+    assert breaker.state == 'half-open'
+    assert breaker.call(is_outage, lambda: 'ok') == 'ok'
+    assert breaker.state == 'closed'
+
+
+def test_breaker_ignores_errors_that_are_not_outages():
+    breaker = CircuitBreaker('test', threshold=1)
+    with pytest.raises(KeyError):
+        breaker.call(is_outage, {}.__getitem__, 'missing')
+    assert breaker.state == 'closed'
+
+
+def test_changed_fields_need_a_fresh_reindex(tmp_path):
+    backend = LocalSearchBackend(str(tmp_path / 'search.db'))
+    backend.index('recipe', 1, {'title': 'Lentil soup'})
+    with pytest.raises(SearchSchemaChanged, match='reindex --fresh'):
+        backend.index('recipe', 2, {'title': 'Dal', 'method': 'Simmer'})
+    assert backend.search('recipe', 'soup', 1, 10)[1] == 1
+
+    building = backend.create_index('recipe')
+    backend.bulk('recipe', [(1, {'title': 'Lentil soup', 'method': 'Boil'})])
+    backend.bulk(building, [(2, {'title': 'Dal', 'method': 'Simmer'})])
+    backend.swap_alias('recipe', building)
+    hits, total = backend.search('recipe', 'simmer boil', 1, 10)
+    assert sorted(id for id, _ in hits) == [1, 2]
+
+
+def test_outbox_lag_is_exported(app, client):
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        db.session.add(Recipe(title='Lentil soup', creator=user))
+        db.session.commit()
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'recipefinder_search_outbox_pending 1\n' in metrics
+    assert '# TYPE recipefinder_search_outbox_lag_seconds gauge' in metrics
+    with app.app_context():
+        app.search_indexer.drain()
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert 'recipefinder_search_outbox_pending 0\n' in metrics
+    assert 'recipefinder_search_outbox_lag_seconds 0.0\n' in metrics
+
+
+def test_local_ranking_is_the_same_on_every_page(tmp_path):
+    backend = LocalSearchBackend(str(tmp_path / 'search.db'), max_total=50)
+    backend.bulk('recipe', [(id, {
+        'title': 'Curry' if id % 7 == 0 else 'Stew',
+        'method': 'Add the curry paste' if id % 2 else 'Simmer'})
+        for id in range(1, 101)])
+    fields = {'title': 4, 'method': 1}
+    hits, total = backend.search('recipe', 'curry', 1, 100, fields)
+    assert total == 50
+    ids = [id for id, _ in hits]
+    # Title and method, then title only, then method only.
+    assert ids[:8] == [91, 77, 63, 49, 35, 21, 98, 84]
+    paged = [id for page in range(1, 11) for id, _ in
+             backend.search('recipe', 'curry', page, 5, fields)[0]]
+    assert paged == ids
+    assert backend.search('recipe', 'curry', 11, 5, fields) == ([], 50)
+
+
+def test_outbox_left_by_an_earlier_process_is_drained(app):
+    add_user(app, 'alice')
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        db.session.add(Recipe(title='Lentil soup', creator=user))
+        db.session.commit()
+
+    class RestartConfig:
+        pass
+    for key, value in app.config.items():
+        setattr(RestartConfig, key, value)
+    RestartConfig.SEARCH_INDEXER_THREAD = True
+    RestartConfig.SEARCH_INDEXER_INTERVAL = 0.05
+    restarted = create_app(RestartConfig)
+    indexer = restarted.search_indexer
+    deadline = time.monotonic() + 5
+    with restarted.app_context():
+        while indexer.lag()[0] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert indexer.lag()[0] == 0
+        assert restarted.search_backend.search('recipe', 'lentil', 1, 5)[1] == 1
+    indexer.interval = 3600
+    time.sleep(0.2)
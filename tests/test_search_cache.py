@@ -0,0 +1,41 @@
+import sqlalchemy as sa
+from app import db
+from app.cache import SearchCache
+from app.models import Recipe, User
+
+
+def test_entries_expire_and_are_counted():
+    cache = SearchCache(max_entries=2, ttl=60)
+    assert cache.get('a') is None
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    cache.set('b', 2)
+    cache.set('c', 3)
+    assert cache.get('a') is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_index_writes_invalidate_cached_results(app, client):
+    with app.app_context():
+        recipe = Recipe(title='Lentil soup',
+                        creator=db.session.scalar(sa.select(User)))
+        db.session.add(recipe)
+        db.session.commit()
+        app.search_indexer.drain()
+        cache = app.search_cache
+        generation = cache.generation
+
+        results, total = Recipe.search('lentil', 1, 5)
+        assert [r.title for r in results] == ['Lentil soup']
+        assert Recipe.search('lentil', 1, 5) == (results, total)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        recipe.title = 'Lentil dal'
+        db.session.commit()
+        # Until the change is indexed the cached page is still current.
+        assert Recipe.search('lentil', 1, 5) == (results, total)
+        app.search_indexer.drain()
+        assert cache.generation == generation + 1
+        results, _ = Recipe.search('lentil', 1, 5)
+        assert [r.title for r in results] == ['Lentil dal']
+        assert (cache.hits, cache.misses) == (2, 2)
@@ -0,0 +1,36 @@
+import sqlalchemy as sa
+from app import db
+from app.models import Recipe, User
+from app.shopping import ShoppingItem, shopping_list
+
+
+def test_same_ingredient_is_merged_across_recipes_and_units():
+    rows = [(1, 'olive oil', 1, 'tbsp'), (2, 'Olive oil', 3, 'tsp'),
+            (1, 'eggs', 1, 'dozen'), (2, 'egg', 6, ''),
+            (1, 'flour', 200, 'g'), (3, 'flour', 0.5, 'kg'),
+            (2, 'flour', 1, 'cup'),
+            (1, 'thyme', 2, 'sprigs'), (2, 'thyme', 1, 'sprig'),
+            (3, 'salt', None, '')]
+    assert shopping_list(rows) == [
+        ShoppingItem(18.0, '', 'eggs', 2),
+        ShoppingItem(700.0, 'g', 'flour', 2),
+        # Mass and volume cannot be added up without a density.
+        ShoppingItem(1.0, 'cup', 'flour', 1),
+        ShoppingItem(29.6, 'ml', 'olive oil', 2),
+        ShoppingItem(None, '', 'salt', 1),
+        ShoppingItem(3.0, 'sprigs', 'thyme', 2),
+    ]
+
+
+def test_removing_from_the_meal_plan_returns_to_the_shopping_list(app, client):
+    with app.app_context():
+        recipe = Recipe(title='Soup', creator=db.session.scalar(sa.select(User)))
+        db.session.add(recipe)
+        db.session.commit()
+        id = recipe.id
+    client.get('/meal_plan/add/{}'.format(id))
+    response = client.get('/meal_plan/remove/{}'.format(id),
+                          headers={'Referer': 'https://example.com/'})
+    assert response.headers['Location'] == '/shopping_list'
+    with client.session_transaction() as session:
+        assert session['meal_plan'] == []
@@ -0,0 +1,41 @@
+import sqlalchemy as sa
+from app import db
+from app.models import Ingredient, Recipe, User
+from app.similar import NUM_HASHES, minhash
+from conftest import add_user
+
+
+def add_recipe(app, title, ingredients):
+    with app.app_context():
+        user = db.session.scalar(sa.select(User))
+        recipe = Recipe(title=title, creator=user)
+        db.session.add(recipe)
+        db.session.flush()
+        for description in ingredients:
+            db.session.add(Ingredient(description=description,
+                                      recipe_id=recipe.id))
+        db.session.commit()
+        return recipe.id
+
+
+def test_minhash_estimates_jaccard_similarity():
+    a = minhash({'egg', 'flour', 'milk', 'butter'})
+    assert minhash({'butter', 'milk', 'flour', 'egg'}) == a
+    b = minhash({'rice', 'stock', 'onion', 'parmesan'})
+    assert sum(x == y for x, y in zip(a, b)) < NUM_HASHES / 2
+
+
+def test_similar_recipes(app):
+    add_user(app, 'alice')
+    pancakes = add_recipe(app, 'Pancakes', ['egg', 'flour', 'milk', 'butter',
+                                            'sugar', 'salt'])
+    crepes = add_recipe(app, 'Crepes', ['egg', 'flour', 'milk', 'butter',
+                                        'sugar', 'salt', 'lemon'])
+    add_recipe(app, 'Risotto', ['rice', 'stock', 'onion', 'parmesan'])
+    with app.app_context():
+        index = app.similar_index
+        index._signatures, index._band_keys, index._band_ids = index._build()
+        index.loaded = float('inf')
+        similar = index.similar(pancakes)
+    assert [id for id, _ in similar] == [crepes]
+    assert similar[0][1] > 0.5
@@ -0,0 +1,107 @@
+import sqlite3
+import threading
+from concurrent.futures import Future
+import pytest
+import sqlalchemy as sa
+from app import db
+from app.models import User
+from app.sqlite import retry_on_busy
+
+
+def locked():
+    return sa.exc.OperationalError(
+        'INSERT', {}, sqlite3.OperationalError('database is locked'))
+
+
+def add(username, calls=None):
+    def job():
+        if calls is not None:
+            calls.append(username)
+        user = User(username=username, email=username + '@example.com')
+        db.session.add(user)
+        return username
+    return job
+
+
+def fail():
+    raise ValueError('bad job')
+
+
+def usernames(app):
+    with app.app_context():
+        return db.session.scalars(
+            sa.select(User.username).order_by(User.username)).all()
+
+
+def start_writer(app, jobs):
+    writer = app.writer
+    writer.enabled = True
+    futures = []
+    for job in jobs:
+        future = Future()
+        writer._queue.put((job, future))
+        futures.append(future)
+    # Everything is queued before the writer starts, so it is one group.
+    writer._thread = threading.Thread(target=writer._run, daemon=True)
+    writer._thread.start()
+    return futures
+
+
+def test_failed_job_is_dropped_from_the_group(app):
+    calls = []
+    futures = start_writer(app, [add('ann', calls), fail, add('cat', calls)])
+    assert futures[0].result(timeout=5) == 'ann'
+    with pytest.raises(ValueError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 'cat'
+    assert usernames(app) == ['ann', 'cat']
+    # The group was rolled back at the failure and run again without it.
+    assert calls == ['ann', 'ann', 'cat']
+
+
+def test_busy_group_is_retried_whole(app):
+    attempts = []
+
+    def busy_once():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise locked()
+        return 'ok'
+    futures = start_writer(app, [add('ann'), busy_once, add('cat')])
+    assert [future.result(timeout=5) for future in futures] == \
+        ['ann', 'ok', 'cat']
+    assert usernames(app) == ['ann', 'cat']
+    assert len(attempts) == 2
+
+
+def test_retry_on_busy(app):
+    attempts = []
+
+    def busy_twice():
+        attempts.append(1)
+        if len(attempts) <= 2:
+            raise locked()
+        return 'ok'
+    with app.app_context():
+        assert retry_on_busy(busy_twice, backoff=0) == 'ok'
+        assert len(attempts) == 3
+
+        attempts.clear()
+        with pytest.raises(sa.exc.OperationalError):
+            retry_on_busy(busy_twice, retries=1, backoff=0)
+        assert len(attempts) == 2
+
+        def no_such_table():
+            attempts.append(1)
+            raise sa.exc.OperationalError(
+                'SELECT', {}, sqlite3.OperationalError('no such table: x'))
+        attempts.clear()
+        with pytest.raises(sa.exc.OperationalError):
+            retry_on_busy(no_such_table, backoff=0)
+        assert len(attempts) == 1
+
+
+def test_run_commits_outside_group_mode(app):
+    with app.app_context():
+        assert app.writer.run(add('ann')) == 'ann'
+    assert usernames(app) == ['ann']
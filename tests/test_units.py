@@ -0,0 +1,64 @@
+import pytest
+from app.units import ScaledIngredient, convert, format_ingredient, \
+    normalize_unit, parse_ingredient, round_quantity, scale_ingredients
+
+
+@pytest.mark.parametrize('line, expected', [
+    ('1 1/2 cups plain flour', (1.5, 'cup', 'plain flour')),
+    ('250g butter', (250.0, 'g', 'butter')),
+    ('3 fl. oz milk', (3.0, 'fl oz', 'milk')),
+    ('2 eggs', (2.0, '', 'eggs')),
+    ('salt', (None, '', 'salt')),
+])
+def test_parse_ingredient(line, expected):
+    assert parse_ingredient(line) == expected
+
+
+@pytest.mark.parametrize('line', ['1/0 cup flour', '1 2/0 tsp salt'])
+def test_parse_ingredient_rejects_zero_denominator(line):
+    with pytest.raises(ValueError):
+        parse_ingredient(line)
+
+
+def test_format_ingredient_round_trips():
+    assert format_ingredient(2.0, 'sprig', 'thyme') == '2 sprig thyme'
+    assert format_ingredient(1.5, 'cup', 'flour') == '1.5 cup flour'
+    assert format_ingredient(None, '', 'salt') == 'salt'
+    assert format_ingredient(float('inf'), '', 'x') == 'inf x'
+
+
+@pytest.mark.parametrize('unit, expected', [
+    ('Tablespoons', 'tbsp'), ('fl. oz', 'fl oz'), ('KG', 'kg'),
+    ('sprigs', 'sprigs'), (None, None),
+])
+def test_normalize_unit(unit, expected):
+    assert normalize_unit(unit) == expected
+
+
+def test_convert_scales_without_changing_units():
+    assert convert([1, 2, None], ['cup', 'sprig', ''], 0.5) == \
+        ([0.5, 1.0, None], ['cup', 'sprig', ''])
+
+
+def test_convert_to_metric_picks_the_largest_fitting_unit():
+    quantities, units = convert([1, 3, 2, 500, 2],
+                                ['tbsp', 'tsp', 'cup', 'g', 'sprig'],
+                                factor=2, metric=True)
+    assert units == ['ml', 'ml', 'ml', 'kg', 'sprig']
+    assert quantities == pytest.approx([29.57, 29.57, 946.35, 1, 4], abs=0.01)
+
+
+def test_round_quantity():
+    assert [round_quantity(q) for q in (0.333, 12.345, 1234.5, None)] == \
+        [0.33, 12.3, 1234.0, None]
+
+
+def test_scale_ingredients():
+    ingredients = [ScaledIngredient(3, 'cup', 'flour'),
+                   ScaledIngredient(2, 'lb', 'beef'),
+                   ScaledIngredient(1, '', 'eggs'),
+                   ScaledIngredient(None, '', 'salt')]
+    assert scale_ingredients(ingredients, 2, metric=True) == [
+        (1.42, 'l', 'flour'), (1.81, 'kg', 'beef'), (2.0, '', 'eggs'),
+        (None, '', 'salt')]
+    assert scale_ingredients(ingredients[:1], 1 / 9) == [(0.33, 'cup', 'flour')]